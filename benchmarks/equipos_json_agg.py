@@ -0,0 +1,95 @@
+"""
+Benchmark del listado de equipos: camino actual (dict por fila + encoder de
+FastAPI) contra el camino rápido con json_agg armado en PostgreSQL.
+
+Inserta equipos sintéticos dentro de una transacción que se revierte al
+final, así que puede ejecutarse contra una base con datos reales.
+
+Uso:
+    DATABASE_URL=postgresql://... python benchmarks/equipos_json_agg.py 10000 100000
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+import asyncpg
+from fastapi.encoders import jsonable_encoder
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "equipos_service"))
+from main import equipo_a_dict, query_listado_equipos, query_listado_json  # noqa: E402
+
+REPETICIONES = 5
+
+
+async def insertar_sinteticos(conn, n: int):
+    await conn.execute(
+        """
+        INSERT INTO equipos (
+            codigo_inventario, nombre, marca, modelo, numero_serie,
+            especificaciones, fecha_compra, costo_compra, fecha_garantia_fin,
+            estado_operativo
+        )
+        SELECT 'BENCH-' || g, 'Equipo ' || g, 'Marca', 'Modelo', 'BENCH-SN-' || g,
+               '{"ram": "8GB", "cpu": "i5"}'::jsonb,
+               DATE '2020-01-01' + (g % 1500), 500 + (g % 1000) / 3.0,
+               DATE '2023-01-01' + (g % 1500), 'operativo'
+        FROM generate_series(1, $1) g
+        """,
+        n
+    )
+
+
+async def camino_actual(conn, query, params) -> bytes:
+    rows = await conn.fetch(query + " ORDER BY e.fecha_registro DESC", *params)
+    data = [equipo_a_dict(row) for row in rows]
+    # Equivalente a lo que hace JSONResponse con el valor de retorno
+    return json.dumps(jsonable_encoder(data), ensure_ascii=False, separators=(",", ":")).encode()
+
+
+async def camino_json_agg(conn, query, params) -> bytes:
+    payload = await conn.fetchval(query_listado_json(query), *params)
+    return payload.encode()
+
+
+async def medir(fn, *args):
+    tiempos = []
+    size = 0
+    for _ in range(REPETICIONES):
+        t0 = time.perf_counter()
+        body = await fn(*args)
+        tiempos.append(time.perf_counter() - t0)
+        size = len(body)
+    tiempos.sort()
+    return tiempos[len(tiempos) // 2], size
+
+
+async def main(tamanios):
+    conn = await asyncpg.connect(os.environ["DATABASE_URL"])
+    query, params = query_listado_equipos()
+
+    try:
+        for n in tamanios:
+            tr = conn.transaction()
+            await tr.start()
+            try:
+                await conn.execute("DELETE FROM equipos WHERE codigo_inventario LIKE 'BENCH-%'")
+                await insertar_sinteticos(conn, n)
+                total = await conn.fetchval("SELECT COUNT(*) FROM equipos")
+
+                t_actual, size_actual = await medir(camino_actual, conn, query, params)
+                t_rapido, size_rapido = await medir(camino_json_agg, conn, query, params)
+
+                print(f"{total:>8} filas | actual {t_actual * 1000:8.1f} ms ({size_actual / 1e6:.1f} MB)"
+                      f" | json_agg {t_rapido * 1000:8.1f} ms ({size_rapido / 1e6:.1f} MB)"
+                      f" | x{t_actual / t_rapido:.1f}")
+            finally:
+                await tr.rollback()
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    tamanios = [int(a) for a in sys.argv[1:]] or [10_000, 100_000]
+    asyncio.run(main(tamanios))
@@ -0,0 +1,69 @@
+"""
+Prueba de carga simple para mantenimiento_service: N clientes concurrentes
+mezclando GET /mantenimientos y POST /mantenimientos durante unos segundos.
+Reporta throughput y latencias p50/p95.
+
+--escrituras fija la proporción de POST (1.0 = solo inserts, que aísla el
+costo de conexión del de serializar el listado completo).
+
+Uso (con el servicio levantado):
+    python benchmarks/mantenimiento_carga.py http://localhost:8003 --clientes 50 --segundos 15 --equipo-id 1
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import httpx
+
+
+async def cliente(http: httpx.AsyncClient, fin: float, equipo_id: int, escrituras: float,
+                  latencias: list, errores: list):
+    rnd = random.Random()
+    while time.perf_counter() < fin:
+        t0 = time.perf_counter()
+        try:
+            if rnd.random() < escrituras:
+                r = await http.post(
+                    "/mantenimientos",
+                    params={"equipo_id": equipo_id, "tipo": "preventivo", "costo": 1.0}
+                )
+            else:
+                r = await http.get("/mantenimientos")
+            if r.status_code != 200:
+                errores.append(r.status_code)
+        except httpx.HTTPError as exc:
+            errores.append(type(exc).__name__)
+        latencias.append(time.perf_counter() - t0)
+
+
+async def main(args):
+    latencias: list[float] = []
+    errores: list = []
+    limits = httpx.Limits(max_connections=args.clientes)
+
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30) as http:
+        inicio = time.perf_counter()
+        fin = inicio + args.segundos
+        await asyncio.gather(*[
+            cliente(http, fin, args.equipo_id, args.escrituras, latencias, errores)
+            for _ in range(args.clientes)
+        ])
+        duracion = time.perf_counter() - inicio
+
+    latencias.sort()
+    p95 = latencias[int(len(latencias) * 0.95) - 1] if latencias else 0
+    print(f"clientes={args.clientes} requests={len(latencias)} errores={len(errores)}")
+    print(f"throughput={len(latencias) / duracion:.1f} req/s "
+          f"p50={statistics.median(latencias) * 1000:.1f} ms p95={p95 * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("url")
+    parser.add_argument("--clientes", type=int, default=50)
+    parser.add_argument("--segundos", type=float, default=15)
+    parser.add_argument("--equipo-id", type=int, default=1)
+    parser.add_argument("--escrituras", type=float, default=0.2)
+    asyncio.run(main(parser.parse_args()))
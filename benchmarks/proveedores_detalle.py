@@ -0,0 +1,95 @@
+"""
+Latencia p50/p95 del detalle de proveedor: las tres consultas secuenciales
+originales contra la consulta única con LATERAL + json_agg
+(PROVEEDOR_DETALLE de proveedores_service).
+
+Crea un proveedor sintético con muchos equipos y contratos dentro de una
+transacción que se revierte al final.
+
+Uso:
+    DATABASE_URL=postgresql://... python benchmarks/proveedores_detalle.py --equipos 5000 --contratos 2000
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+import asyncpg
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "proveedores_service"))
+from main import PROVEEDOR_DETALLE  # noqa: E402
+
+
+async def detalle_original(conn, proveedor_id):
+    proveedor = await conn.fetchrow("SELECT * FROM proveedores WHERE id = $1", proveedor_id)
+    resultado = dict(proveedor)
+    equipos = await conn.fetch(
+        "SELECT COUNT(*) as total, SUM(costo_compra) as total_comprado FROM equipos WHERE proveedor_id = $1",
+        proveedor_id
+    )
+    resultado["estadisticas_compras"] = dict(equipos[0])
+    contratos = await conn.fetch(
+        "SELECT * FROM contratos WHERE proveedor_id = $1 ORDER BY fecha_inicio DESC",
+        proveedor_id
+    )
+    resultado["contratos"] = [dict(c) for c in contratos]
+    return resultado
+
+
+async def detalle_unico(conn, proveedor_id):
+    return await conn.fetchrow(PROVEEDOR_DETALLE, proveedor_id, 50, 0)
+
+
+async def medir(fn, conn, proveedor_id, iteraciones):
+    tiempos = []
+    for _ in range(iteraciones):
+        t0 = time.perf_counter()
+        await fn(conn, proveedor_id)
+        tiempos.append(time.perf_counter() - t0)
+    tiempos.sort()
+    return statistics.median(tiempos) * 1000, tiempos[int(len(tiempos) * 0.95) - 1] * 1000
+
+
+async def main(args):
+    conn = await asyncpg.connect(os.environ["DATABASE_URL"])
+    tr = conn.transaction()
+    await tr.start()
+    try:
+        proveedor_id = await conn.fetchval(
+            "INSERT INTO proveedores (razon_social, ruc) VALUES ('Proveedor Benchmark', 'BENCH-RUC') RETURNING id"
+        )
+        await conn.execute(
+            """
+            INSERT INTO equipos (codigo_inventario, nombre, proveedor_id, costo_compra)
+            SELECT 'BENCH-P-' || g, 'Equipo ' || g, $1, 100 + g % 900
+            FROM generate_series(1, $2) g
+            """,
+            proveedor_id, args.equipos
+        )
+        await conn.execute(
+            """
+            INSERT INTO contratos (proveedor_id, numero_contrato, tipo, fecha_inicio, fecha_fin, monto_total)
+            SELECT $1, 'BENCH-C-' || g, 'soporte', DATE '2015-01-01' + g, DATE '2016-01-01' + g, 1000 + g
+            FROM generate_series(1, $2) g
+            """,
+            proveedor_id, args.contratos
+        )
+        await conn.execute("ANALYZE equipos; ANALYZE contratos")
+
+        for nombre, fn in (("3 consultas (original)", detalle_original), ("LATERAL + json_agg", detalle_unico)):
+            await medir(fn, conn, proveedor_id, 5)
+            p50, p95 = await medir(fn, conn, proveedor_id, args.iteraciones)
+            print(f"{nombre:<24} p50={p50:7.2f} ms  p95={p95:7.2f} ms")
+    finally:
+        await tr.rollback()
+        await conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--equipos", type=int, default=5000)
+    parser.add_argument("--contratos", type=int, default=2000)
+    parser.add_argument("--iteraciones", type=int, default=200)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,94 @@
+"""
+Memoria pico y tiempo de la exportación de equipos a Excel: el camino
+original (fetch completo + DataFrame + dos BytesIO) contra la escritura por
+cursor con XlsxWriter en modo constant_memory (escribir_excel de
+reportes_service).
+
+Cada camino corre en un subproceso para medir su RSS máximo por separado.
+Los equipos sintéticos se confirman (los subprocesos usan otra conexión) y
+se borran al terminar.
+
+Uso:
+    DATABASE_URL=postgresql://... python benchmarks/reportes_excel.py 100000 1000000
+"""
+import asyncio
+import io
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import asyncpg
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "reportes_service"))
+from main import CONSULTAS_EXPORTACION, escribir_excel  # noqa: E402
+
+
+async def camino_original(conn) -> int:
+    import pandas as pd
+
+    rows = await conn.fetch(CONSULTAS_EXPORTACION["equipos"])
+    df = pd.DataFrame([dict(row) for row in rows])
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
+        df.to_excel(writer, index=False, sheet_name="Equipos")
+        worksheet = writer.sheets["Equipos"]
+        for idx, col in enumerate(df.columns):
+            max_length = max(df[col].map(lambda v: len(str(v))).max(), len(str(col))) + 2
+            worksheet.set_column(idx, idx, min(max_length, 50))
+    output.seek(0)
+    return len(io.BytesIO(output.read()).getvalue())
+
+
+async def camino_streaming(conn) -> int:
+    fd, path = tempfile.mkstemp(suffix=".xlsx")
+    os.close(fd)
+    try:
+        await escribir_excel(conn, "equipos", path)
+        return os.path.getsize(path)
+    finally:
+        os.remove(path)
+
+
+async def medir(modo: str):
+    conn = await asyncpg.connect(os.environ["DATABASE_URL"])
+    try:
+        t0 = time.perf_counter()
+        size = await (camino_original if modo == "original" else camino_streaming)(conn)
+        duracion = time.perf_counter() - t0
+    finally:
+        await conn.close()
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{modo:<10} {duracion:7.1f} s  RSS máx {rss_mb:7.0f} MB  archivo {size / 1e6:6.1f} MB")
+
+
+async def main(tamanios):
+    conn = await asyncpg.connect(os.environ["DATABASE_URL"])
+    try:
+        for n in tamanios:
+            await conn.execute("DELETE FROM equipos WHERE codigo_inventario LIKE 'BENCH-X-%'")
+            await conn.execute(
+                """
+                INSERT INTO equipos (codigo_inventario, nombre, marca, modelo, fecha_compra,
+                                     costo_compra, estado_operativo)
+                SELECT 'BENCH-X-' || g, 'Equipo ' || g, 'Marca', 'Modelo',
+                       DATE '2020-01-01' + (g % 1500), 500 + (g % 1000) / 3.0, 'operativo'
+                FROM generate_series(1, $1) g
+                """,
+                n
+            )
+            print(f"--- {await conn.fetchval('SELECT COUNT(*) FROM equipos')} equipos")
+            for modo in ("original", "streaming"):
+                subprocess.run([sys.executable, __file__, "--modo", modo], check=True)
+    finally:
+        await conn.execute("DELETE FROM equipos WHERE codigo_inventario LIKE 'BENCH-X-%'")
+        await conn.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--modo":
+        asyncio.run(medir(sys.argv[2]))
+    else:
+        asyncio.run(main([int(a) for a in sys.argv[1:]] or [100_000, 1_000_000]))
@@ -0,0 +1,62 @@
+"""
+Tiempo de generación y tamaño del export de equipos en cada formato de
+reportes_service (xlsx, csv.gz, parquet, arrow), usando escribir_archivo
+sobre la misma consulta de CONSULTAS_EXPORTACION.
+
+Inserta equipos sintéticos dentro de una transacción que se revierte al
+final.
+
+Uso:
+    DATABASE_URL=postgresql://... python benchmarks/reportes_formatos.py 100000 1000000
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import asyncpg
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "reportes_service"))
+from main import FORMATOS_ARCHIVO, escribir_archivo  # noqa: E402
+
+
+async def main(tamanios):
+    conn = await asyncpg.connect(os.environ["DATABASE_URL"])
+    try:
+        for n in tamanios:
+            tr = conn.transaction()
+            await tr.start()
+            try:
+                await conn.execute(
+                    """
+                    INSERT INTO equipos (codigo_inventario, nombre, marca, modelo, fecha_compra,
+                                         costo_compra, estado_operativo)
+                    SELECT 'BENCH-F-' || g, 'Equipo ' || g, 'Marca', 'Modelo',
+                           DATE '2020-01-01' + (g % 1500), 500 + (g % 1000) / 3.0, 'operativo'
+                    FROM generate_series(1, $1) g
+                    """,
+                    n
+                )
+                total = await conn.fetchval("SELECT COUNT(*) FROM equipos")
+                print(f"--- {total} equipos")
+
+                for formato, (extension, _) in FORMATOS_ARCHIVO.items():
+                    fd, path = tempfile.mkstemp(suffix=f".{extension}")
+                    os.close(fd)
+                    try:
+                        t0 = time.perf_counter()
+                        await escribir_archivo(conn, "equipos", formato, path)
+                        duracion = time.perf_counter() - t0
+                        size = os.path.getsize(path)
+                    finally:
+                        os.remove(path)
+                    print(f"{extension:<8} {duracion:7.2f} s  {size / 1e6:7.1f} MB")
+            finally:
+                await tr.rollback()
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main([int(a) for a in sys.argv[1:]] or [100_000, 1_000_000]))
@@ -0,0 +1,127 @@
+"""
+Latencia p50 de los reportes de distribución, antigüedad, garantía y valor
+de reportes_service sobre tres fuentes: la consulta GROUP BY original sobre
+equipos, la lectura de la vista materializada y el snapshot columnar en
+memoria (SnapshotFlota). Mide además la carga completa del snapshot y la
+aplicación de un lote de cambios del feed equipos_cambios.
+
+Inserta equipos sintéticos dentro de una transacción que se revierte al
+final.
+
+Uso:
+    DATABASE_URL=postgresql://... python benchmarks/reportes_snapshot.py --equipos 1000000
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+import asyncpg
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "services", "reportes_service"))
+from main import VISTAS_REPORTES, SnapshotFlota, sincronizar_snapshot  # noqa: E402
+
+REPORTES = {
+    "mv_equipos_por_ubicacion": SnapshotFlota.por_ubicacion,
+    "mv_equipos_por_estado": SnapshotFlota.por_estado,
+    "mv_equipos_por_categoria": SnapshotFlota.por_categoria,
+    "mv_equipos_antiguedad": SnapshotFlota.antiguedad,
+    "mv_equipos_garantia": SnapshotFlota.garantia,
+}
+
+
+async def p50_async(fn, iteraciones):
+    tiempos = []
+    for _ in range(iteraciones):
+        t0 = time.perf_counter()
+        await fn()
+        tiempos.append(time.perf_counter() - t0)
+    return statistics.median(tiempos) * 1000
+
+
+def p50(fn, iteraciones):
+    tiempos = []
+    for _ in range(iteraciones):
+        t0 = time.perf_counter()
+        fn()
+        tiempos.append(time.perf_counter() - t0)
+    return statistics.median(tiempos) * 1000
+
+
+async def main(args):
+    conn = await asyncpg.connect(os.environ["DATABASE_URL"])
+    tr = conn.transaction()
+    await tr.start()
+    try:
+        await conn.execute(
+            "INSERT INTO categorias_equipos (nombre) SELECT 'BENCH-S-' || g FROM generate_series(1, 20) g"
+        )
+        await conn.execute(
+            """
+            INSERT INTO ubicaciones (edificio, aula_oficina)
+            SELECT 'BENCH-S-' || (g % 5), 'Aula ' || g FROM generate_series(1, 200) g
+            """
+        )
+        # La carga sintética no pasa por el feed: el delta medido trae solo el lote de cambios
+        await conn.execute("ALTER TABLE equipos DISABLE TRIGGER trg_cambios_equipos_insert")
+        await conn.execute(
+            """
+            INSERT INTO equipos (codigo_inventario, categoria_id, ubicacion_actual_id, estado_operativo,
+                                 fecha_compra, costo_compra, fecha_garantia_fin)
+            SELECT 'BENCH-S-' || g, c.ids[1 + g % 20], u.ids[1 + g % 200],
+                   (ARRAY['operativo', 'en_reparacion', 'obsoleto', 'en_almacen', 'baja'])[1 + g % 5],
+                   CASE WHEN g % 50 <> 0 THEN CURRENT_DATE - (g * 7 % 4000) END,
+                   200 + (g % 2000) / 3.0,
+                   CASE WHEN g % 10 <> 0 THEN CURRENT_DATE - 1500 + (g * 11 % 3000) END
+            FROM generate_series(1, $1) g,
+                 (SELECT array_agg(id) AS ids FROM categorias_equipos WHERE nombre LIKE 'BENCH-S-%') c,
+                 (SELECT array_agg(id) AS ids FROM ubicaciones WHERE edificio LIKE 'BENCH-S-%') u
+            """,
+            args.equipos
+        )
+        await conn.execute("ALTER TABLE equipos ENABLE TRIGGER trg_cambios_equipos_insert")
+        await conn.execute("ANALYZE equipos")
+        for vista in REPORTES:
+            await conn.execute(f"REFRESH MATERIALIZED VIEW {vista}")
+
+        snapshot = SnapshotFlota()
+        t0 = time.perf_counter()
+        await sincronizar_snapshot(conn, snapshot)
+        carga = time.perf_counter() - t0
+        print(f"--- {len(snapshot.columnas['id'])} equipos: carga completa {carga:.2f} s, "
+              f"{snapshot.memoria_bytes / 1e6:.1f} MB en memoria")
+
+        print(f"{'reporte':<26} {'GROUP BY':>11} {'vista':>11} {'snapshot':>11}")
+        for vista, calcular in REPORTES.items():
+            definicion = await conn.fetchval("SELECT definition FROM pg_matviews WHERE matviewname = $1", vista)
+            directo = await p50_async(lambda: conn.fetch(definicion), max(3, args.iteraciones // 20))
+            leida = await p50_async(lambda: conn.fetch(VISTAS_REPORTES[vista]), args.iteraciones)
+            memoria = p50(lambda: calcular(snapshot), args.iteraciones)
+            print(f"{vista[3:]:<26} {directo:8.2f} ms {leida:8.2f} ms {memoria:8.3f} ms")
+
+        await conn.execute(
+            "UPDATE equipos SET estado_operativo = 'en_reparacion' WHERE id IN "
+            "(SELECT id FROM equipos WHERE codigo_inventario LIKE 'BENCH-S-%' ORDER BY random() LIMIT $1)",
+            args.cambios
+        )
+        await conn.execute(
+            "DELETE FROM equipos WHERE id IN "
+            "(SELECT id FROM equipos WHERE codigo_inventario LIKE 'BENCH-S-%' ORDER BY id DESC LIMIT $1)",
+            args.cambios // 10
+        )
+        t0 = time.perf_counter()
+        await sincronizar_snapshot(conn, snapshot)
+        print(f"delta de {snapshot.equipos_actualizados} equipos: {(time.perf_counter() - t0) * 1000:.1f} ms")
+    finally:
+        await tr.rollback()
+        await conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--equipos", type=int, default=1_000_000)
+    parser.add_argument("--cambios", type=int, default=1000)
+    parser.add_argument("--iteraciones", type=int, default=200)
+    asyncio.run(main(parser.parse_args()))
@@ -79,6 +79,23 @@ CREATE TABLE movimientos_equipos (
     observaciones TEXT
 );
 
+-- Tabla de planes de mantenimiento preventivo
+CREATE TABLE planes_mantenimiento (
+    id SERIAL PRIMARY KEY,
+    nombre VARCHAR(100) NOT NULL,
+    categoria_id INT REFERENCES categorias_equipos(id),
+    equipo_ids INT[],
+    intervalo_meses INT NOT NULL CHECK (intervalo_meses > 0),
+    horizonte_meses INT NOT NULL DEFAULT 12 CHECK (horizonte_meses > 0),
+    fecha_inicio DATE NOT NULL DEFAULT CURRENT_DATE,
+    tipo VARCHAR(50) DEFAULT 'preventivo',
+    prioridad VARCHAR(50) DEFAULT 'media',
+    descripcion TEXT,
+    activo BOOLEAN DEFAULT TRUE,
+    fecha_registro TIMESTAMP DEFAULT NOW(),
+    CONSTRAINT plan_con_alcance CHECK (categoria_id IS NOT NULL OR equipo_ids IS NOT NULL)
+);
+
 -- Tabla de mantenimientos
 CREATE TABLE mantenimientos (
     id SERIAL PRIMARY KEY,
@@ -90,7 +107,10 @@ CREATE TABLE mantenimientos (
     descripcion TEXT,
     costo DECIMAL(10,2),
     estado VARCHAR(50) DEFAULT 'programado', -- programado, en_proceso, completado, cancelado
-    prioridad VARCHAR(50) DEFAULT 'media' -- urgente, alta, media, baja
+    prioridad VARCHAR(50) DEFAULT 'media', -- urgente, alta, media, baja
+    tecnico_id INT REFERENCES usuarios(id),
+    fecha_asignacion TIMESTAMP,
+    plan_id INT REFERENCES planes_mantenimiento(id)
 );
 
 -- Tabla de contratos
@@ -115,3 +135,332 @@ CREATE TABLE notificaciones (
     leida BOOLEAN DEFAULT FALSE,
     fecha TIMESTAMP DEFAULT NOW()
 );
+
+-- Índices de apoyo
+CREATE INDEX IF NOT EXISTS idx_equipos_ubicacion ON equipos (ubicacion_actual_id);
+CREATE INDEX IF NOT EXISTS idx_equipos_proveedor_compra ON equipos (proveedor_id, fecha_compra);
+CREATE INDEX IF NOT EXISTS idx_equipos_compra ON equipos (fecha_compra);
+CREATE INDEX IF NOT EXISTS idx_contratos_proveedor_inicio ON contratos (proveedor_id, fecha_inicio DESC);
+CREATE INDEX IF NOT EXISTS idx_contratos_inicio ON contratos (fecha_inicio);
+CREATE INDEX IF NOT EXISTS idx_contratos_vigentes_fin ON contratos (fecha_fin) WHERE estado = 'vigente';
+
+-- Búsqueda por subcadena en proveedores (ILIKE '%texto%'). Si pg_trgm no
+-- está instalado o el rol no puede crear extensiones, la búsqueda sigue
+-- funcionando sin estos índices y el resto del esquema se crea igual.
+DO $$
+BEGIN
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    CREATE INDEX IF NOT EXISTS idx_proveedores_razon_social_trgm ON proveedores USING gin (razon_social gin_trgm_ops);
+    CREATE INDEX IF NOT EXISTS idx_proveedores_ruc_trgm ON proveedores USING gin (ruc gin_trgm_ops);
+EXCEPTION WHEN feature_not_supported OR insufficient_privilege THEN
+    RAISE WARNING 'pg_trgm no disponible, búsqueda de proveedores sin índices trigram: %', SQLERRM;
+END
+$$;
+CREATE INDEX IF NOT EXISTS idx_proveedores_orden ON proveedores (razon_social, id);
+
+-- El listado pagina por id DESC: cada filtro termina en id para que la
+-- página salga del índice en orden, sin leer y ordenar todas las coincidencias
+CREATE INDEX IF NOT EXISTS idx_mantenimientos_equipo_id ON mantenimientos (equipo_id, id);
+CREATE INDEX IF NOT EXISTS idx_mantenimientos_estado_id ON mantenimientos (estado, id);
+CREATE INDEX IF NOT EXISTS idx_mantenimientos_abiertos ON mantenimientos (prioridad, id)
+    WHERE estado IN ('programado', 'en_proceso');
+CREATE INDEX IF NOT EXISTS idx_mantenimientos_fecha_programada ON mantenimientos (fecha_programada);
+
+-- Fecha efectiva de la orden, usada para filtrar por mes con rangos
+CREATE INDEX IF NOT EXISTS idx_mantenimientos_fecha_efectiva ON mantenimientos (
+    (COALESCE(fecha_realizada, fecha_programada, fecha_registro))
+);
+
+-- Cola de trabajo: órdenes programadas sin técnico, por prioridad, fecha de
+-- vencimiento (sin fecha = ya vencida) y antigüedad. Con la fecha en la clave
+-- el claim empieza en la primera orden vencida de cada prioridad, sin
+-- recorrer las órdenes futuras que agregan los planes.
+CREATE INDEX IF NOT EXISTS idx_mantenimientos_cola ON mantenimientos (
+    (CASE prioridad WHEN 'urgente' THEN 1 WHEN 'alta' THEN 2 WHEN 'media' THEN 3 WHEN 'baja' THEN 4 ELSE 5 END),
+    (COALESCE(fecha_programada, DATE '-infinity')),
+    id
+) WHERE estado = 'programado' AND tecnico_id IS NULL;
+
+-- Una sola orden por plan, equipo y fecha: hace idempotente la expansión de planes
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mantenimientos_plan ON mantenimientos (plan_id, equipo_id, fecha_programada)
+    WHERE plan_id IS NOT NULL;
+
+-- Resumen mensual de mantenimientos por equipo. Se mantiene con triggers por
+-- sentencia (tablas de transición), así que también cubre COPY y las
+-- expansiones de planes. El mes es el de COALESCE(fecha_realizada,
+-- fecha_programada, fecha_registro).
+CREATE TABLE IF NOT EXISTS mantenimientos_resumen_mensual (
+    equipo_id INT NOT NULL,
+    mes DATE NOT NULL,
+    cantidad INT NOT NULL DEFAULT 0,
+    costo_total DECIMAL(14,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (equipo_id, mes)
+);
+
+-- Los upserts salen ordenados por (equipo_id, mes) para que sentencias
+-- concurrentes bloqueen las filas del resumen siempre en el mismo orden.
+CREATE OR REPLACE FUNCTION fn_resumen_mantenimientos() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO mantenimientos_resumen_mensual AS r (equipo_id, mes, cantidad, costo_total)
+        SELECT equipo_id,
+               date_trunc('month', COALESCE(fecha_realizada, fecha_programada, fecha_registro))::date AS mes,
+               COUNT(*),
+               COALESCE(SUM(costo), 0)
+        FROM filas_nuevas
+        WHERE equipo_id IS NOT NULL
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+        ON CONFLICT (equipo_id, mes) DO UPDATE
+        SET cantidad = r.cantidad + EXCLUDED.cantidad,
+            costo_total = r.costo_total + EXCLUDED.costo_total;
+
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO mantenimientos_resumen_mensual AS r (equipo_id, mes, cantidad, costo_total)
+        SELECT equipo_id,
+               date_trunc('month', COALESCE(fecha_realizada, fecha_programada, fecha_registro))::date AS mes,
+               -COUNT(*),
+               -COALESCE(SUM(costo), 0)
+        FROM filas_viejas
+        WHERE equipo_id IS NOT NULL
+        GROUP BY 1, 2
+        ORDER BY 1, 2
+        ON CONFLICT (equipo_id, mes) DO UPDATE
+        SET cantidad = r.cantidad + EXCLUDED.cantidad,
+            costo_total = r.costo_total + EXCLUDED.costo_total;
+
+    ELSE
+        -- Solo cuentan las filas que cambian de equipo, de mes o de costo: los
+        -- cambios de estado o de técnico (claim, iniciar, cancelar) no tocan el resumen
+        INSERT INTO mantenimientos_resumen_mensual AS r (equipo_id, mes, cantidad, costo_total)
+        SELECT d.equipo_id, d.mes, SUM(d.cantidad), SUM(d.costo)
+        FROM filas_viejas v
+        FULL JOIN filas_nuevas n ON n.id = v.id
+        CROSS JOIN LATERAL (VALUES
+            (v.equipo_id,
+             date_trunc('month', COALESCE(v.fecha_realizada, v.fecha_programada, v.fecha_registro))::date,
+             -1, -COALESCE(v.costo, 0)),
+            (n.equipo_id,
+             date_trunc('month', COALESCE(n.fecha_realizada, n.fecha_programada, n.fecha_registro))::date,
+             1, COALESCE(n.costo, 0))
+        ) AS d (equipo_id, mes, cantidad, costo)
+        WHERE d.equipo_id IS NOT NULL
+          AND (v.id IS NULL OR n.id IS NULL
+               OR (v.equipo_id,
+                   date_trunc('month', COALESCE(v.fecha_realizada, v.fecha_programada, v.fecha_registro)),
+                   COALESCE(v.costo, 0))
+                  IS DISTINCT FROM
+                  (n.equipo_id,
+                   date_trunc('month', COALESCE(n.fecha_realizada, n.fecha_programada, n.fecha_registro)),
+                   COALESCE(n.costo, 0)))
+        GROUP BY 1, 2
+        HAVING SUM(d.cantidad) <> 0 OR SUM(d.costo) <> 0
+        ORDER BY 1, 2
+        ON CONFLICT (equipo_id, mes) DO UPDATE
+        SET cantidad = r.cantidad + EXCLUDED.cantidad,
+            costo_total = r.costo_total + EXCLUDED.costo_total;
+    END IF;
+
+    -- Solo un equipo/mes que perdió filas puede quedar en cero
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM mantenimientos_resumen_mensual r
+        USING (SELECT DISTINCT equipo_id,
+                      date_trunc('month', COALESCE(fecha_realizada, fecha_programada, fecha_registro))::date AS mes
+               FROM filas_viejas) v
+        WHERE r.equipo_id = v.equipo_id AND r.mes = v.mes AND r.cantidad = 0;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_resumen_mantenimientos_ins
+    AFTER INSERT ON mantenimientos
+    REFERENCING NEW TABLE AS filas_nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_resumen_mantenimientos();
+
+CREATE TRIGGER trg_resumen_mantenimientos_upd
+    AFTER UPDATE ON mantenimientos
+    REFERENCING OLD TABLE AS filas_viejas NEW TABLE AS filas_nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_resumen_mantenimientos();
+
+CREATE TRIGGER trg_resumen_mantenimientos_del
+    AFTER DELETE ON mantenimientos
+    REFERENCING OLD TABLE AS filas_viejas
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_resumen_mantenimientos();
+
+-- Reconstrucción completa: psql -c "SELECT reconstruir_resumen_mantenimientos();"
+CREATE OR REPLACE FUNCTION reconstruir_resumen_mantenimientos() RETURNS INT AS $$
+DECLARE
+    filas INT;
+BEGIN
+    -- Bloquea escrituras concurrentes en mantenimientos mientras se recalcula
+    LOCK TABLE mantenimientos IN SHARE MODE;
+    DELETE FROM mantenimientos_resumen_mensual;
+
+    INSERT INTO mantenimientos_resumen_mensual (equipo_id, mes, cantidad, costo_total)
+    SELECT equipo_id,
+           date_trunc('month', COALESCE(fecha_realizada, fecha_programada, fecha_registro))::date,
+           COUNT(*),
+           COALESCE(SUM(costo), 0)
+    FROM mantenimientos
+    WHERE equipo_id IS NOT NULL
+    GROUP BY 1, 2;
+
+    GET DIAGNOSTICS filas = ROW_COUNT;
+    RETURN filas;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Vistas materializadas para los reportes de distribución de equipos. Se
+-- refrescan con REFRESH ... CONCURRENTLY (requiere el índice único) desde
+-- reportes_service o a mano:
+--   psql -c "SELECT refrescar_vista_reporte(vista) FROM reportes_vistas_refresco;"
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_equipos_por_ubicacion AS
+SELECT u.id AS ubicacion_id,
+       u.edificio || ' - ' || u.aula_oficina AS ubicacion,
+       COUNT(*) AS cantidad
+FROM equipos e
+JOIN ubicaciones u ON e.ubicacion_actual_id = u.id
+GROUP BY u.id, u.edificio, u.aula_oficina;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_equipos_por_ubicacion ON mv_equipos_por_ubicacion (ubicacion_id);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_equipos_por_estado AS
+SELECT estado_operativo AS estado, COUNT(*) AS cantidad
+FROM equipos
+GROUP BY estado_operativo;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_equipos_por_estado ON mv_equipos_por_estado (estado);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_equipos_por_categoria AS
+SELECT c.nombre AS categoria,
+       COUNT(*) AS cantidad,
+       COALESCE(SUM(e.costo_compra), 0) AS valor_total
+FROM equipos e
+JOIN categorias_equipos c ON e.categoria_id = c.id
+GROUP BY c.nombre;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_equipos_por_categoria ON mv_equipos_por_categoria (categoria);
+
+-- Los rangos dependen de CURRENT_DATE al momento del refresco
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_equipos_antiguedad AS
+SELECT rango_antiguedad, MIN(orden) AS orden, COUNT(*) AS cantidad
+FROM (
+    SELECT
+        CASE
+            WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, fecha_compra)) < 1 THEN 'Menos de 1 año'
+            WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, fecha_compra)) BETWEEN 1 AND 2 THEN '1-2 años'
+            WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, fecha_compra)) BETWEEN 3 AND 4 THEN '3-4 años'
+            WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, fecha_compra)) BETWEEN 5 AND 6 THEN '5-6 años'
+            ELSE 'Más de 6 años'
+        END AS rango_antiguedad,
+        CASE
+            WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, fecha_compra)) < 1 THEN 1
+            WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, fecha_compra)) BETWEEN 1 AND 2 THEN 2
+            WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, fecha_compra)) BETWEEN 3 AND 4 THEN 3
+            WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, fecha_compra)) BETWEEN 5 AND 6 THEN 4
+            ELSE 5
+        END AS orden
+    FROM equipos
+    WHERE fecha_compra IS NOT NULL
+) t
+GROUP BY rango_antiguedad;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_equipos_antiguedad ON mv_equipos_antiguedad (rango_antiguedad);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_equipos_garantia AS
+SELECT
+    CASE
+        WHEN fecha_garantia_fin >= CURRENT_DATE THEN 'En garantía'
+        WHEN fecha_garantia_fin < CURRENT_DATE THEN 'Fuera de garantía'
+        ELSE 'Sin información'
+    END AS estado_garantia,
+    COUNT(*) AS cantidad
+FROM equipos
+GROUP BY estado_garantia;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_equipos_garantia ON mv_equipos_garantia (estado_garantia);
+
+-- Momento del último refresco de cada vista, devuelto junto con los datos
+CREATE TABLE IF NOT EXISTS reportes_vistas_refresco (
+    vista TEXT PRIMARY KEY,
+    refrescado_en TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+INSERT INTO reportes_vistas_refresco (vista) VALUES
+    ('mv_equipos_por_ubicacion'),
+    ('mv_equipos_por_estado'),
+    ('mv_equipos_por_categoria'),
+    ('mv_equipos_antiguedad'),
+    ('mv_equipos_garantia')
+ON CONFLICT (vista) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION refrescar_vista_reporte(p_vista TEXT) RETURNS TIMESTAMPTZ AS $$
+DECLARE
+    momento TIMESTAMPTZ;
+BEGIN
+    -- Solo se aceptan las vistas registradas en reportes_vistas_refresco
+    PERFORM 1 FROM reportes_vistas_refresco WHERE vista = p_vista;
+    IF NOT FOUND THEN
+        RAISE EXCEPTION 'Vista de reporte desconocida: %', p_vista;
+    END IF;
+
+    EXECUTE format('REFRESH MATERIALIZED VIEW CONCURRENTLY %I', p_vista);
+
+    UPDATE reportes_vistas_refresco
+    SET refrescado_en = clock_timestamp()
+    WHERE vista = p_vista
+    RETURNING refrescado_en INTO momento;
+    RETURN momento;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Feed de cambios de equipos para el snapshot en memoria de reportes_service:
+-- un registro por equipo insertado, borrado o con cambios en las columnas del
+-- snapshot, con el id de la transacción que lo modificó. El lector pide los
+-- registros con txid >= xmin de su lectura anterior, así no pierde cambios de
+-- transacciones que confirmaron después. equipo_id NULL (TRUNCATE) pide una
+-- recarga completa.
+CREATE TABLE IF NOT EXISTS equipos_cambios (
+    equipo_id INT,
+    txid XID8 NOT NULL DEFAULT pg_current_xact_id(),
+    registrado_en TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_equipos_cambios_txid ON equipos_cambios (txid);
+CREATE INDEX IF NOT EXISTS idx_equipos_cambios_registrado ON equipos_cambios (registrado_en);
+
+CREATE OR REPLACE FUNCTION fn_registrar_cambios_equipos() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO equipos_cambios (equipo_id) SELECT id FROM filas_nuevas;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO equipos_cambios (equipo_id) SELECT id FROM filas_anteriores;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO equipos_cambios (equipo_id)
+        SELECT COALESCE(n.id, a.id)
+        FROM filas_nuevas n
+        FULL JOIN filas_anteriores a ON a.id = n.id
+        WHERE n.id IS NULL OR a.id IS NULL
+           OR (n.categoria_id, n.ubicacion_actual_id, n.estado_operativo,
+               n.fecha_compra, n.costo_compra, n.fecha_garantia_fin)
+              IS DISTINCT FROM
+              (a.categoria_id, a.ubicacion_actual_id, a.estado_operativo,
+               a.fecha_compra, a.costo_compra, a.fecha_garantia_fin);
+    ELSE
+        INSERT INTO equipos_cambios (equipo_id) VALUES (NULL);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_cambios_equipos_insert
+    AFTER INSERT ON equipos REFERENCING NEW TABLE AS filas_nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_registrar_cambios_equipos();
+
+CREATE TRIGGER trg_cambios_equipos_update
+    AFTER UPDATE ON equipos REFERENCING OLD TABLE AS filas_anteriores NEW TABLE AS filas_nuevas
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_registrar_cambios_equipos();
+
+CREATE TRIGGER trg_cambios_equipos_delete
+    AFTER DELETE ON equipos REFERENCING OLD TABLE AS filas_anteriores
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_registrar_cambios_equipos();
+
+CREATE TRIGGER trg_cambios_equipos_truncate
+    AFTER TRUNCATE ON equipos
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_registrar_cambios_equipos();
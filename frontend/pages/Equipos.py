@@ -58,6 +58,21 @@ def get_ubicaciones():
     except:
         return []
 
+def autocomplete_equipos(prefix, campo="ambos", limit=20):
+    if not prefix:
+        return []
+    try:
+        response = requests.get(
+            f"{API_URL}/equipos/equipos/autocomplete",
+            params={"prefix": prefix, "campo": campo, "limit": limit},
+            timeout=5
+        )
+        if response.status_code == 200:
+            return response.json()
+        return []
+    except:
+        return []
+
 def get_proveedores():
     try:
         response = requests.get(f"{API_URL}/proveedores/proveedores", timeout=10)
@@ -171,6 +186,14 @@ with tab1:
         # Filtrar equipos para asegurar que solo contengan diccionarios válidos con 'codigo_inventario'
         valid_equipos = [e for e in equipos if isinstance(e, dict) and 'codigo_inventario' in e]
 
+        # Búsqueda rápida por prefijo de código o número de serie
+        busqueda = st.text_input("Buscar por código o serie", placeholder="EQ-2024 / ABC123")
+        if busqueda:
+            sugeridos = {s['codigo_inventario'] for s in autocomplete_equipos(busqueda)}
+            valid_equipos = [e for e in valid_equipos if e['codigo_inventario'] in sugeridos]
+            if not valid_equipos:
+                st.info("Ningún equipo del listado coincide con la búsqueda")
+
         equipo_seleccionado = st.selectbox(
             "Seleccionar equipo",
             options=[e['codigo_inventario'] for e in valid_equipos],
@@ -276,8 +299,11 @@ with tab2:
         submitted = st.form_submit_button("💾 Guardar Equipo", use_container_width=True)
 
     if submitted:
+        existentes = [s['codigo_inventario'] for s in autocomplete_equipos(codigo, campo="codigo", limit=5)]
         if not codigo or not nombre or categoria_id is None:
             st.error("⚠️ Los campos Código, Nombre y Categoría son obligatorios")
+        elif codigo.strip().upper() in [c.upper() for c in existentes]:
+            st.error(f"⚠️ El código {codigo} ya está registrado")
         else:
             nuevo_equipo = {
                 "codigo_inventario": codigo,
@@ -24,34 +24,76 @@ def normalize_tuples(rows, keys):
                 out.append(d)
     return out
 
+COLUMNAS = ["id", "equipo_id", "fecha", "tipo", "costo", "estado", "prioridad", "descripcion"]
+
 @st.cache_data(ttl=15)
-def fetch_mantenimientos():
+def fetch_mantenimientos(filtros=None, cursor=None, limit=200):
+    params = {k: v for k, v in (filtros or {}).items() if v}
+    params["limit"] = limit
+    if cursor:
+        params["cursor"] = cursor
     try:
-        r = requests.get(f"{API_URL}/mantenimiento/mantenimientos", timeout=10)
+        r = requests.get(f"{API_URL}/mantenimiento/mantenimientos", params=params, timeout=10)
         if r.status_code == 200:
             data = r.json()
-            # Admitir {"mantenimientos": [...]}
+            siguiente = None
+            # Admitir {"mantenimientos": [...], "siguiente_cursor": ...}
             if isinstance(data, dict) and "mantenimientos" in data:
+                siguiente = data.get("siguiente_cursor")
                 data = data["mantenimientos"]
             # Admitir [lista, 200]
             if isinstance(data, list) and len(data) == 2 and isinstance(data[0], list) and isinstance(data[1], int):
                 data = data[0]
-            return normalize_tuples(data, ["id","equipo_id","fecha","tipo","costo"]) if isinstance(data, list) else []
+            return (normalize_tuples(data, COLUMNAS) if isinstance(data, list) else []), siguiente
     except Exception as e:
         st.warning(f"No se pudo obtener mantenimientos: {e}")
-    return []
+    return [], None
 
 tab1, tab2 = st.tabs(["📋 Lista", "➕ Nuevo"])
 
 with tab1:
-    mantenimientos = fetch_mantenimientos()
     st.subheader("Listado de Mantenimientos")
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        f_equipo = st.number_input("ID de Equipo (0 = todos)", min_value=0, step=1)
+    with col2:
+        f_estado = st.selectbox("Estado", ["", "programado", "en_proceso", "completado", "cancelado"])
+    with col3:
+        f_prioridad = st.selectbox("Prioridad", ["", "urgente", "alta", "media", "baja"])
+    with col4:
+        f_tipo = st.selectbox("Tipo", ["", "preventivo", "correctivo", "calibracion", "otro"], key="f_tipo")
+
+    filtros = {
+        "equipo_id": int(f_equipo) or None,
+        "estado": f_estado,
+        "prioridad": f_prioridad,
+        "tipo": f_tipo,
+    }
+
+    # Pila de cursores para navegar entre páginas
+    if st.session_state.get("mant_filtros") != filtros:
+        st.session_state["mant_filtros"] = filtros
+        st.session_state["mant_cursores"] = [None]
+    cursores = st.session_state["mant_cursores"]
+
+    mantenimientos, siguiente = fetch_mantenimientos(filtros, cursores[-1])
     if mantenimientos:
         df = pd.DataFrame(mantenimientos)
         st.dataframe(df, use_container_width=True, height=420)
     else:
         st.info("No hay mantenimientos registrados.")
 
+    col1, col2, _ = st.columns([1, 1, 4])
+    with col1:
+        if len(cursores) > 1 and st.button("⬅️ Anterior", use_container_width=True):
+            cursores.pop()
+            st.rerun()
+    with col2:
+        if siguiente and st.button("Siguiente ➡️", use_container_width=True):
+            cursores.append(siguiente)
+            st.rerun()
+
 with tab2:
     st.subheader("Registrar Mantenimiento")
     with st.form("form_mant"):
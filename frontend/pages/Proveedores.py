@@ -11,9 +11,12 @@ st.title("🏷️ Proveedores")
 st.markdown("---")
 
 @st.cache_data(ttl=30)
-def fetch_proveedores():
+def fetch_proveedores(q=None):
+    params = {"estadisticas": "true"}
+    if q:
+        params["q"] = q
     try:
-        r = requests.get(f"{API_URL}/proveedores/proveedores", timeout=10)
+        r = requests.get(f"{API_URL}/proveedores/proveedores", params=params, timeout=10)
         if r.status_code == 200:
             data = r.json()
             # Normalizar: permitir [lista, 200] o dict envolviendo
@@ -28,7 +31,8 @@ def fetch_proveedores():
         st.warning(f"No se pudo obtener proveedores: {e}")
     return []
 
-proveedores = fetch_proveedores()
+busqueda = st.text_input("Buscar por razón social o RUC")
+proveedores = fetch_proveedores(busqueda.strip() or None)
 
 col1, col2 = st.columns([2,1])
 with col1:
@@ -36,7 +40,8 @@ with col1:
     if proveedores:
         df = pd.DataFrame(proveedores)
         # columnas amigables
-        cols = [c for c in ["id","razon_social","ruc","telefono","email","activo"] if c in df.columns]
+        cols = [c for c in ["id","razon_social","ruc","telefono","email","activo",
+                            "total_equipos","total_comprado","contratos_vigentes","proximo_vencimiento"] if c in df.columns]
         st.dataframe(df[cols] if cols else df, use_container_width=True, height=400)
     else:
         st.info("No hay proveedores registrados.")
@@ -55,5 +60,10 @@ with col2:
                 st.write(f"**Teléfono:** {p.get('telefono','')}")
                 st.write(f"**Email:** {p.get('email','')}")
                 st.write(f"**Activo:** {'Sí' if p.get('activo') else 'No'}")
+                if p.get("total_equipos") is not None:
+                    st.write(f"**Equipos comprados:** {p.get('total_equipos')}")
+                    st.write(f"**Total comprado:** ${float(p.get('total_comprado') or 0):,.2f}")
+                    st.write(f"**Contratos vigentes:** {p.get('contratos_vigentes')}")
+                    st.write(f"**Próximo vencimiento:** {p.get('proximo_vencimiento') or 'N/A'}")
     else:
         st.caption("Sin datos para mostrar detalles")
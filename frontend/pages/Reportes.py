@@ -4,6 +4,7 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import os
+import time
 from datetime import datetime
 
 st.set_page_config(page_title="Reportes y Análisis", page_icon="📊", layout="wide")
@@ -29,6 +30,15 @@ def normalize_list_of_dicts(data, keys):
                 result.append(mapped)
     return result
 
+def mostrar_actualizacion(data):
+    """Muestra la fecha del último refresco si la respuesta la incluye."""
+    if isinstance(data, dict) and data.get('actualizado_en'):
+        try:
+            momento = datetime.fromisoformat(data['actualizado_en']).astimezone()
+            st.caption(f"Datos actualizados al {momento.strftime('%d/%m/%Y %H:%M')}")
+        except ValueError:
+            pass
+
 st.title("📊 Reportes y Análisis")
 st.markdown("---")
 
@@ -88,6 +98,36 @@ def get_equipos_antiguedad():
     except:
         return []
 
+def exportar_con_trabajo(tipo, formato, espera_max=600):
+    """Encola la exportación, espera a que termine y devuelve los bytes (o None)."""
+    response = requests.post(
+        f"{API_URL}/reportes/export/jobs",
+        json={"type": tipo, "formato": formato},
+        timeout=10
+    )
+    if response.status_code != 200:
+        st.error(f"No se pudo encolar la exportación: HTTP {response.status_code}")
+        return None
+    trabajo = response.json()
+
+    inicio = time.time()
+    while trabajo.get("estado") in ("pendiente", "en_proceso"):
+        if time.time() - inicio > espera_max:
+            st.warning("La exportación sigue en proceso. Vuelva a intentarlo en unos minutos.")
+            return None
+        time.sleep(1)
+        trabajo = requests.get(f"{API_URL}/reportes/export/jobs/{trabajo['id']}", timeout=10).json()
+
+    if trabajo.get("estado") != "completado":
+        st.error(f"Error al generar la exportación: {trabajo.get('error') or trabajo.get('detail')}")
+        return None
+
+    descarga = requests.get(f"{API_URL}/reportes/export/jobs/{trabajo['id']}/descarga", timeout=120)
+    if descarga.status_code != 200:
+        st.error(f"No se pudo descargar el archivo: HTTP {descarga.status_code}")
+        return None
+    return descarga.content
+
 # Tabs principales
 tab1, tab2, tab3, tab4 = st.tabs(["📈 Dashboard", "📊 Gráficos", "📄 Exportar", "🔍 Análisis Avanzado"])
 
@@ -162,6 +202,7 @@ with tab2:
     # Equipos por ubicación
     st.markdown("### 📍 Equipos por Ubicación")
     data_ubicacion = get_equipos_por_ubicacion()
+    mostrar_actualizacion(data_ubicacion)
     if isinstance(data_ubicacion, dict) and 'data' in data_ubicacion:
         data_ubicacion = data_ubicacion['data']
     # Normalizar a lista de dicts con claves esperadas
@@ -204,6 +245,7 @@ with tab2:
     with col1:
         st.markdown("### 🟢 Equipos por Estado")
         data_estado = get_equipos_por_estado()
+        mostrar_actualizacion(data_estado)
         if isinstance(data_estado, dict) and 'data' in data_estado:
             data_estado = data_estado['data']
         # Normalizar a lista de dicts con claves esperadas
@@ -238,6 +280,7 @@ with tab2:
     with col2:
         st.markdown("### 📦 Equipos por Categoría")
         data_categoria = get_equipos_por_categoria()
+        mostrar_actualizacion(data_categoria)
         if isinstance(data_categoria, dict) and 'data' in data_categoria:
             data_categoria = data_categoria['data']
         # Normalizar a lista de dicts con claves esperadas
@@ -326,6 +369,7 @@ with tab2:
     st.markdown("### ⏰ Antigüedad de Equipos")
     data_antiguedad = get_equipos_antiguedad()
     # Normalizar a lista de dicts con claves esperadas
+    mostrar_actualizacion(data_antiguedad)
     if isinstance(data_antiguedad, dict) and 'data' in data_antiguedad:
         data_antiguedad = data_antiguedad['data']
     data_antiguedad = normalize_list_of_dicts(
@@ -369,45 +413,18 @@ with tab3:
         if st.button("📥 Generar PDF", use_container_width=True):
             with st.spinner("Generando PDF..."):
                 try:
-                    response = requests.post(
-                        f"{API_URL}/reportes/export/pdf",
-                        json={"type": tipo_reporte_pdf},
-                        timeout=30
-                    )
-                    
-                    if response.status_code == 200:
-                        result = response.json()
-                        fname = result.get('filename')
-                        st.success(f"✅ PDF generado: {fname}")
-                        if fname:
-                            # Descargar vía gateway
-                            try:
-                                from os.path import basename
-                                safe_name = basename(fname)
-                                file_resp = requests.get(
-                                    f"{API_URL}/reportes/export/file",
-                                    params={"filename": safe_name},
-                                    timeout=30
-                                )
-                                if file_resp.status_code == 200:
-                                    st.download_button(
-                                        label="⬇️ Descargar PDF",
-                                        data=file_resp.content,
-                                        file_name=safe_name,
-                                        mime="application/pdf",
-                                        use_container_width=True
-                                    )
-                                else:
-                                    st.info(f"PDF generado en servidor, pero no se pudo descargar automáticamente (HTTP {file_resp.status_code}).")
-                                    st.link_button(
-                                        label="🔗 Abrir/Descargar PDF",
-                                        url=f"{PUBLIC_GATEWAY_URL}/reportes/export/file?filename={safe_name}",
-                                        use_container_width=True
-                                    )
-                            except Exception as de:
-                                st.info(f"PDF guardado en servidor. Descarga manual fallida: {de}")
-                    else:
-                        st.error("Error al generar PDF")
+                    pdf_bytes = exportar_con_trabajo(tipo_reporte_pdf, "pdf")
+                    if pdf_bytes:
+                        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+                        safe_name = f"{tipo_reporte_pdf}_{timestamp}.pdf"
+                        st.success(f"✅ PDF generado ({len(pdf_bytes)} bytes)")
+                        st.download_button(
+                            label="⬇️ Descargar PDF",
+                            data=pdf_bytes,
+                            file_name=safe_name,
+                            mime="application/pdf",
+                            use_container_width=True
+                        )
                 except Exception as e:
                     st.error(f"Error: {e}")
                 
@@ -423,51 +440,65 @@ with tab3:
         if st.button("📥 Generar Excel", use_container_width=True):
             with st.spinner("Generando Excel..."):
                 try:
-                    response = requests.post(
-                        f"{API_URL}/reportes/export/excel",
-                        json={"type": tipo_reporte_excel},
-                        timeout=30,
-                        stream=True  # Agregar streaming
-                    )
+                    excel_bytes = exportar_con_trabajo(tipo_reporte_excel, "xlsx")
+                    if excel_bytes:
+                        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+                        safe_name = f"{tipo_reporte_excel}_{timestamp}.xlsx"
 
-                    if response.status_code == 200:
-                        # Verificar que el contenido no esté vacío
-                        excel_bytes = response.content
-                        
-                        if len(excel_bytes) == 0:
-                            st.error("El archivo Excel está vacío")
+                        # Verificar que los primeros bytes son correctos (ZIP header)
+                        if excel_bytes[:2] == b'PK':
+                            st.success(f"✅ Excel generado exitosamente ({len(excel_bytes)} bytes)")
+
+                            st.download_button(
+                                label="⬇️ Descargar Excel",
+                                data=excel_bytes,
+                                file_name=safe_name,
+                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                                use_container_width=True
+                            )
                         else:
-                            # Nombre del archivo
-                            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                            safe_name = f"{tipo_reporte_excel}_{timestamp}.xlsx"
-                            
-                            # Verificar que los primeros bytes son correctos (ZIP header)
-                            if excel_bytes[:2] == b'PK':
-                                st.success(f"✅ Excel generado exitosamente ({len(excel_bytes)} bytes)")
-                                
-                                st.download_button(
-                                    label="⬇️ Descargar Excel",
-                                    data=excel_bytes,
-                                    file_name=safe_name,
-                                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                    use_container_width=True
-                                )
-                            else:
-                                st.error("El archivo descargado no es un Excel válido")
-                                st.code(f"Primeros bytes: {excel_bytes[:50]}")
-                    else:
-                        st.error(f"Error al generar Excel: HTTP {response.status_code}")
-                        try:
-                            error_detail = response.json()
-                            st.error(f"Detalle: {error_detail}")
-                        except:
-                            st.error(f"Respuesta: {response.text[:200]}")
+                            st.error("El archivo descargado no es un Excel válido")
+                            st.code(f"Primeros bytes: {excel_bytes[:50]}")
                 except requests.exceptions.Timeout:
                     st.error("La petición tardó demasiado. El servidor puede estar sobrecargado.")
                 except Exception as e:
                     st.error(f"Error: {str(e)}")
-                    import traceback
-                    st.code(traceback.format_exc())
+
+    st.markdown("---")
+    st.markdown("### 🧮 Exportar datos para análisis")
+    st.write("Formatos livianos para pandas y herramientas de BI")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        tipo_reporte_datos = st.selectbox(
+            "Tipo de Reporte (datos)",
+            ["equipos", "mantenimientos", "proveedores"]
+        )
+    with col2:
+        formatos_datos = {
+            "CSV comprimido (.csv.gz)": ("csv", "csv.gz", "application/gzip"),
+            "Parquet (.parquet)": ("parquet", "parquet", "application/vnd.apache.parquet"),
+            "Arrow IPC (.arrow)": ("arrow", "arrow", "application/vnd.apache.arrow.file"),
+        }
+        formato_datos = st.selectbox("Formato", list(formatos_datos))
+
+    if st.button("📥 Generar archivo de datos", use_container_width=True):
+        formato, extension, mime = formatos_datos[formato_datos]
+        with st.spinner("Generando archivo..."):
+            try:
+                datos_bytes = exportar_con_trabajo(tipo_reporte_datos, formato)
+                if datos_bytes:
+                    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+                    st.success(f"✅ Archivo generado ({len(datos_bytes)} bytes)")
+                    st.download_button(
+                        label="⬇️ Descargar archivo",
+                        data=datos_bytes,
+                        file_name=f"{tipo_reporte_datos}_{timestamp}.{extension}",
+                        mime=mime,
+                        use_container_width=True
+                    )
+            except Exception as e:
+                st.error(f"Error: {str(e)}")
 
 with tab4:
     st.subheader("🔍 Análisis Avanzado")
@@ -542,6 +573,46 @@ with tab4:
             
             st.plotly_chart(fig, use_container_width=True)
     
+    st.markdown("---")
+    st.markdown("### 🧩 Explorador de Equipos")
+    st.write("Agrupa el inventario por una o dos dimensiones con una sola consulta")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        dimensiones_sel = st.multiselect(
+            "Agrupar por",
+            ["categoria", "estado", "ubicacion", "edificio", "proveedor", "mes_compra"],
+            default=["categoria", "estado"],
+            max_selections=2
+        )
+    with col2:
+        medida_sel = st.selectbox("Medida", ["cantidad", "costo_total", "antiguedad_promedio"])
+
+    if dimensiones_sel:
+        try:
+            response = requests.post(
+                f"{API_URL}/reportes/query",
+                json={"dimensiones": dimensiones_sel, "medidas": [medida_sel]},
+                timeout=10
+            )
+            filas = response.json().get("filas", []) if response.status_code == 200 else []
+        except Exception:
+            filas = []
+
+        if filas:
+            df_query = pd.DataFrame(filas)
+            fig = px.bar(
+                df_query,
+                x=dimensiones_sel[0],
+                y=medida_sel,
+                color=dimensiones_sel[1] if len(dimensiones_sel) > 1 else None,
+                barmode='group',
+                title=f"{medida_sel} por {' y '.join(dimensiones_sel)}"
+            )
+            st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.info("No hay datos para la combinación seleccionada.")
+
     st.markdown("---")
     st.markdown("### 📈 Tendencias")
     st.info("💡 Análisis predictivo y tendencias estarán disponibles en próximas versiones")
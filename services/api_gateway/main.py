@@ -16,14 +16,17 @@ SERVICES = {
 BINARY_ENDPOINTS = [
     "/reportes/export/excel",
     "/reportes/export/pdf",
-    "/reportes/export/file"
+    "/reportes/export/file",
+    "/reportes/export/csv",
+    "/reportes/export/parquet",
+    "/reportes/export/arrow"
 ]
 
 @app.get("/")
 def root():
     return {"message": "API Gateway funcionando"}
 
-@app.api_route("/{service}/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
+@app.api_route("/{service}/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
 async def gateway(service: str, path: str, request: Request):
     if service not in SERVICES:
         return JSONResponse(content={"detail": f"Servicio '{service}' no encontrado"}, status_code=404)
@@ -54,6 +57,9 @@ async def gateway(service: str, path: str, request: Request):
                 "application/pdf",
                 "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                 "application/vnd.ms-excel",
+                "application/gzip",
+                "application/vnd.apache.parquet",
+                "application/vnd.apache.arrow.file",
                 "application/octet-stream"
             ])
 
@@ -70,6 +76,15 @@ async def gateway(service: str, path: str, request: Request):
                     }
                 )
 
+            # JSON ya serializado por el microservicio: se reenvían los bytes tal cual
+            # (re-parsearlo anularía el armado en PostgreSQL de GET /equipos?fast=true)
+            if content_type.lower().startswith("application/json"):
+                return Response(
+                    content=response.content,
+                    status_code=response.status_code,
+                    media_type=content_type
+                )
+
             # Para respuestas normales, intentar parsear JSON
             try:
                 data = response.json()
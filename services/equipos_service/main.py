@@ -1,10 +1,14 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import Response
 from pydantic import BaseModel
 from typing import Optional
 import asyncpg
 import os
 from datetime import date
 import json
+import sys
+import time
+from bisect import bisect_left
 
 app = FastAPI(title="Equipos Service", version="1.0.0")
 
@@ -30,6 +34,8 @@ async def on_startup():
         max_size=5
     )
     print("✅ Pool creado en equipos_service")
+    await indice.cargar(pool)
+    print(f"✅ Índice de autocompletado cargado ({len(indice.equipos)} equipos)")
 
 
 @app.on_event("shutdown")
@@ -93,6 +99,243 @@ class MovimientoCreate(BaseModel):
     observaciones: Optional[str] = None
 
 
+class EquipoLookup(BaseModel):
+    ids: list[int] = []
+    codigos: list[str] = []
+
+
+class AuditoriaUbicacion(BaseModel):
+    codigos: list[str]
+
+
+class EquipoFiltro(BaseModel):
+    categoria: Optional[str] = None
+    ubicacion: Optional[int] = None
+    edificio: Optional[str] = None
+    estado: Optional[str] = None
+    ids: Optional[list[int]] = None
+
+
+class EquipoBulkUpdate(BaseModel):
+    filtro: EquipoFiltro
+    cambios: EquipoUpdate
+    dry_run: bool = False
+
+
+# ================================
+#  HELPERS
+# ================================
+EQUIPO_SELECT = """
+    SELECT e.*,
+           c.nombre AS categoria_nombre,
+           COALESCE(u.edificio, '') || ' - ' || COALESCE(u.aula_oficina, '') AS ubicacion_nombre,
+           p.razon_social AS proveedor_nombre
+    FROM equipos e
+    LEFT JOIN categorias_equipos c ON e.categoria_id = c.id
+    LEFT JOIN ubicaciones u ON e.ubicacion_actual_id = u.id
+    LEFT JOIN proveedores p ON e.proveedor_id = p.id
+"""
+
+# Máximo de identificadores aceptados por /equipos/lookup
+MAX_LOOKUP = 5000
+
+
+def filtro_equipos_sql(filtro: EquipoFiltro, px: int = 1):
+    """
+    Traduce un EquipoFiltro a condiciones sobre la tabla equipos (sin joins)
+    para usarlas en UPDATE/SELECT. Devuelve (condiciones, params, px).
+    """
+    conds = []
+    params = []
+
+    if filtro.categoria:
+        conds.append(f"categoria_id = (SELECT id FROM categorias_equipos WHERE nombre = ${px})")
+        params.append(filtro.categoria)
+        px += 1
+
+    if filtro.ubicacion:
+        conds.append(f"ubicacion_actual_id = ${px}")
+        params.append(filtro.ubicacion)
+        px += 1
+
+    if filtro.edificio:
+        conds.append(f"ubicacion_actual_id IN (SELECT id FROM ubicaciones WHERE edificio = ${px})")
+        params.append(filtro.edificio)
+        px += 1
+
+    if filtro.estado:
+        conds.append(f"estado_operativo = ${px}")
+        params.append(filtro.estado)
+        px += 1
+
+    if filtro.ids is not None:
+        conds.append(f"id = ANY(${px}::int[])")
+        params.append(filtro.ids)
+        px += 1
+
+    return conds, params, px
+
+
+def equipo_a_dict(row) -> dict:
+    item = dict(row)
+    if item.get("especificaciones"):
+        try:
+            item["especificaciones"] = json.loads(item["especificaciones"])
+        except:
+            pass
+    return item
+
+
+# ================================
+#  ÍNDICE DE AUTOCOMPLETADO
+# ================================
+class IndicePrefijos:
+    """
+    Arreglo ordenado de claves normalizadas (mayúsculas) con el id del
+    equipo en un arreglo paralelo. La búsqueda por prefijo es un bisect
+    más un recorrido corto, sin tocar la BD.
+    """
+
+    def __init__(self):
+        self.claves: list[str] = []
+        self.ids: list[int] = []
+
+    @staticmethod
+    def normalizar(clave: str) -> str:
+        return clave.strip().upper()
+
+    def construir(self, pares):
+        ordenados = sorted((self.normalizar(k), i) for k, i in pares if k)
+        self.claves = [k for k, _ in ordenados]
+        self.ids = [i for _, i in ordenados]
+
+    def agregar(self, clave: Optional[str], equipo_id: int):
+        if not clave:
+            return
+        clave = self.normalizar(clave)
+        pos = bisect_left(self.claves, clave)
+        self.claves.insert(pos, clave)
+        self.ids.insert(pos, equipo_id)
+
+    def quitar(self, clave: Optional[str], equipo_id: int):
+        if not clave:
+            return
+        clave = self.normalizar(clave)
+        pos = bisect_left(self.claves, clave)
+        while pos < len(self.claves) and self.claves[pos] == clave:
+            if self.ids[pos] == equipo_id:
+                del self.claves[pos]
+                del self.ids[pos]
+                return
+            pos += 1
+
+    def buscar(self, prefijo: str, limite: int) -> list[int]:
+        prefijo = self.normalizar(prefijo)
+        pos = bisect_left(self.claves, prefijo)
+        encontrados = []
+        while pos < len(self.claves) and len(encontrados) < limite:
+            if not self.claves[pos].startswith(prefijo):
+                break
+            encontrados.append(self.ids[pos])
+            pos += 1
+        return encontrados
+
+    def memoria_bytes(self) -> int:
+        return (
+            sys.getsizeof(self.claves)
+            + sys.getsizeof(self.ids)
+            + sum(sys.getsizeof(k) for k in self.claves)
+            + sum(sys.getsizeof(i) for i in self.ids)
+        )
+
+
+class IndiceAutocompletado:
+    """
+    Índices por codigo_inventario y numero_serie, más los datos mínimos
+    que devuelve /equipos/autocomplete. Se construye en el startup y se
+    mantiene en cada alta, modificación y baja de este servicio.
+    """
+
+    def __init__(self):
+        self.codigos = IndicePrefijos()
+        self.series = IndicePrefijos()
+        self.equipos: dict[int, tuple] = {}
+        self.construido_en: Optional[float] = None
+        self.duracion_ms: Optional[float] = None
+
+    async def cargar(self, pool: asyncpg.Pool):
+        t0 = time.perf_counter()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT id, codigo_inventario, numero_serie, nombre FROM equipos"
+            )
+        self.equipos = {r["id"]: (r["codigo_inventario"], r["numero_serie"], r["nombre"]) for r in rows}
+        self.codigos.construir((r["codigo_inventario"], r["id"]) for r in rows)
+        self.series.construir((r["numero_serie"], r["id"]) for r in rows)
+        self.construido_en = time.time()
+        self.duracion_ms = round((time.perf_counter() - t0) * 1000, 2)
+
+    def agregar(self, equipo_id: int, codigo: str, serie: Optional[str], nombre: Optional[str]):
+        self.equipos[equipo_id] = (codigo, serie, nombre)
+        self.codigos.agregar(codigo, equipo_id)
+        self.series.agregar(serie, equipo_id)
+
+    def quitar(self, equipo_id: int):
+        entrada = self.equipos.pop(equipo_id, None)
+        if entrada is None:
+            return
+        codigo, serie, _ = entrada
+        self.codigos.quitar(codigo, equipo_id)
+        self.series.quitar(serie, equipo_id)
+
+    def renombrar(self, equipo_id: int, nombre: Optional[str]):
+        entrada = self.equipos.get(equipo_id)
+        if entrada is not None:
+            self.equipos[equipo_id] = (entrada[0], entrada[1], nombre)
+
+    def buscar(self, prefijo: str, campo: str, limite: int) -> list[dict]:
+        ids = []
+        if campo in ("codigo", "ambos"):
+            ids.extend(self.codigos.buscar(prefijo, limite))
+        if campo in ("serie", "ambos"):
+            ids.extend(self.series.buscar(prefijo, limite))
+
+        resultado = []
+        for equipo_id in dict.fromkeys(ids):
+            codigo, serie, nombre = self.equipos[equipo_id]
+            resultado.append({
+                "id": equipo_id,
+                "codigo_inventario": codigo,
+                "numero_serie": serie,
+                "nombre": nombre,
+            })
+            if len(resultado) >= limite:
+                break
+        return resultado
+
+    def estadisticas(self) -> dict:
+        memoria = {
+            "codigos": self.codigos.memoria_bytes(),
+            "series": self.series.memoria_bytes(),
+            "equipos": sys.getsizeof(self.equipos) + sum(
+                sys.getsizeof(v) + sum(sys.getsizeof(x) for x in v)
+                for v in self.equipos.values()
+            ),
+        }
+        memoria["total"] = sum(memoria.values())
+        return {
+            "equipos": len(self.equipos),
+            "claves_codigo": len(self.codigos.claves),
+            "claves_serie": len(self.series.claves),
+            "memoria_bytes": memoria,
+            "construido_en": self.construido_en,
+            "duracion_carga_ms": self.duracion_ms,
+        }
+
+
+indice = IndiceAutocompletado()
+
+
 # ================================
 #  ENDPOINTS
 # ================================
@@ -105,24 +348,10 @@ async def health():
 # =====================================
 # LISTAR EQUIPOS
 # =====================================
-@app.get("/equipos")
-async def get_equipos(categoria: Optional[str] = None,
-                      estado: Optional[str] = None,
-                      ubicacion: Optional[int] = None):
-
-    pool = await get_pool()
-
-    query = """
-        SELECT e.*,
-               c.nombre AS categoria_nombre,
-               COALESCE(u.edificio, '') || ' - ' || COALESCE(u.aula_oficina, '') AS ubicacion_nombre,
-               p.razon_social AS proveedor_nombre
-        FROM equipos e
-        LEFT JOIN categorias_equipos c ON e.categoria_id = c.id
-        LEFT JOIN ubicaciones u ON e.ubicacion_actual_id = u.id
-        LEFT JOIN proveedores p ON e.proveedor_id = p.id
-        WHERE 1=1
-    """
+def query_listado_equipos(categoria: Optional[str] = None,
+                          estado: Optional[str] = None,
+                          ubicacion: Optional[int] = None):
+    query = EQUIPO_SELECT + " WHERE 1=1"
 
     params = []
     px = 1
@@ -142,22 +371,55 @@ async def get_equipos(categoria: Optional[str] = None,
         params.append(ubicacion)
         px += 1
 
-    query += " ORDER BY e.fecha_registro DESC"
+    return query, params
+
+
+def query_listado_json(query: str) -> str:
+    """
+    Envuelve la consulta del listado para que PostgreSQL construya el
+    arreglo JSON completo y lo devuelva como un único valor de texto.
+    """
+    return f"""
+        SELECT COALESCE(json_agg(t ORDER BY t.fecha_registro DESC), '[]')::text
+        FROM ({query}) t
+    """
+
+
+@app.get("/equipos")
+async def get_equipos(categoria: Optional[str] = None,
+                      estado: Optional[str] = None,
+                      ubicacion: Optional[int] = None,
+                      fast: bool = False):
+
+    pool = await get_pool()
+
+    query, params = query_listado_equipos(categoria, estado, ubicacion)
 
     async with pool.acquire() as conn:
-        rows = await conn.fetch(query, *params)
+        if fast:
+            # Camino rápido: el JSON se arma en la BD y se devuelve sin re-serializar
+            payload = await conn.fetchval(query_listado_json(query), *params)
+            return Response(content=payload.encode(), media_type="application/json")
 
-        result = []
-        for row in rows:
-            item = dict(row)
-            if item.get("especificaciones"):
-                try:
-                    item["especificaciones"] = json.loads(item["especificaciones"])
-                except:
-                    pass
-            result.append(item)
+        rows = await conn.fetch(query + " ORDER BY e.fecha_registro DESC", *params)
+        return [equipo_a_dict(row) for row in rows]
+
+
+# =====================================
+# AUTOCOMPLETADO (EN MEMORIA)
+# =====================================
+@app.get("/equipos/autocomplete")
+async def autocomplete_equipos(prefix: str, campo: str = "ambos", limit: int = 10):
+    if campo not in ("codigo", "serie", "ambos"):
+        raise HTTPException(400, "campo debe ser 'codigo', 'serie' o 'ambos'")
+    if not prefix.strip():
+        return []
+    return indice.buscar(prefix, campo, max(1, min(limit, 100)))
 
-        return result
+
+@app.get("/debug/autocomplete")
+async def debug_autocomplete():
+    return indice.estadisticas()
 
 
 # =====================================
@@ -167,31 +429,61 @@ async def get_equipos(categoria: Optional[str] = None,
 async def get_equipo(equipo_id: int):
     pool = await get_pool()
 
-    query = """
-        SELECT e.*,
-               c.nombre AS categoria_nombre,
-               COALESCE(u.edificio, '') || ' - ' || COALESCE(u.aula_oficina, '') AS ubicacion_nombre,
-               p.razon_social AS proveedor_nombre
-        FROM equipos e
-        LEFT JOIN categorias_equipos c ON e.categoria_id = c.id
-        LEFT JOIN ubicaciones u ON e.ubicacion_actual_id = u.id
-        LEFT JOIN proveedores p ON e.proveedor_id = p.id
-        WHERE e.id = $1
-    """
-
     async with pool.acquire() as conn:
-        row = await conn.fetchrow(query, equipo_id)
+        row = await conn.fetchrow(EQUIPO_SELECT + " WHERE e.id = $1", equipo_id)
         if not row:
             raise HTTPException(404, "Equipo no encontrado")
 
-        item = dict(row)
-        if item.get("especificaciones"):
-            try:
-                item["especificaciones"] = json.loads(item["especificaciones"])
-            except:
-                pass
+        return equipo_a_dict(row)
+
+
+
+# =====================================
+# BÚSQUEDA POR LOTE (IDS / CÓDIGOS)
+# =====================================
+@app.post("/equipos/lookup")
+async def lookup_equipos(data: EquipoLookup):
+    """
+    Resuelve un conjunto de ids y/o códigos de inventario en una sola
+    consulta. Devuelve mapas indexados por el identificador solicitado.
+    """
+    ids = list(dict.fromkeys(data.ids))
+    codigos = list(dict.fromkeys(data.codigos))
 
-        return item
+    if not ids and not codigos:
+        raise HTTPException(400, "Debe enviar al menos un id o código")
+    if len(ids) + len(codigos) > MAX_LOOKUP:
+        raise HTTPException(400, f"Máximo {MAX_LOOKUP} identificadores por solicitud")
+
+    pool = await get_pool()
+
+    query = EQUIPO_SELECT + """
+        WHERE e.id = ANY($1::int[])
+           OR e.codigo_inventario = ANY($2::text[])
+    """
+
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(query, ids, codigos)
+
+    ids_set = set(ids)
+    codigos_set = set(codigos)
+    por_id = {}
+    por_codigo = {}
+    for row in rows:
+        item = equipo_a_dict(row)
+        if item["id"] in ids_set:
+            por_id[str(item["id"])] = item
+        if item["codigo_inventario"] in codigos_set:
+            por_codigo[item["codigo_inventario"]] = item
+
+    return {
+        "por_id": por_id,
+        "por_codigo": por_codigo,
+        "no_encontrados": {
+            "ids": [i for i in ids if str(i) not in por_id],
+            "codigos": [c for c in codigos if c not in por_codigo],
+        },
+    }
 
 
 
@@ -238,6 +530,8 @@ async def create_equipo(data: EquipoCreate):
             data.imagen_url
         )
 
+    indice.agregar(new_id, data.codigo_inventario, data.numero_serie, data.nombre)
+
     return {"id": new_id, "message": "Equipo creado exitosamente"}
 
 
@@ -278,10 +572,69 @@ async def update_equipo(equipo_id: int, data: EquipoUpdate):
         if result == "UPDATE 0":
             raise HTTPException(404, "Equipo no encontrado")
 
+    if "nombre" in body:
+        indice.renombrar(equipo_id, body["nombre"])
+
     return {"message": "Equipo actualizado exitosamente"}
 
 
 
+# =====================================
+# ACTUALIZACIÓN MASIVA POR FILTRO
+# =====================================
+@app.patch("/equipos")
+async def bulk_update_equipos(data: EquipoBulkUpdate):
+    """
+    Aplica los mismos cambios a todos los equipos que cumplen el filtro
+    con un único UPDATE. Con dry_run=True solo informa cuántos se verían
+    afectados.
+    """
+    pool = await get_pool()
+
+    cambios = data.cambios.dict(exclude_unset=True)
+    if not cambios:
+        raise HTTPException(400, "No hay campos para actualizar")
+
+    conds, params, px = filtro_equipos_sql(data.filtro)
+    if not conds:
+        raise HTTPException(400, "Debe indicar al menos un filtro")
+    where = " AND ".join(conds)
+
+    async with pool.acquire() as conn:
+        if data.dry_run:
+            total = await conn.fetchval(f"SELECT COUNT(*) FROM equipos WHERE {where}", *params)
+            return {"dry_run": True, "afectados": total}
+
+        updates = []
+        for k, v in cambios.items():
+            if k == "especificaciones" and v is not None:
+                v = json.dumps(v)
+
+            updates.append(f"{k} = ${px}")
+            params.append(v)
+            px += 1
+
+        total, ids = await conn.fetchrow(
+            f"""
+            WITH actualizados AS (
+                UPDATE equipos
+                SET {', '.join(updates)}
+                WHERE {where}
+                RETURNING id
+            )
+            SELECT COUNT(*), array_agg(id) FROM actualizados
+            """,
+            *params
+        )
+
+    if "nombre" in cambios:
+        for equipo_id in ids or []:
+            indice.renombrar(equipo_id, cambios["nombre"])
+
+    return {"dry_run": False, "afectados": total, "message": "Equipos actualizados exitosamente"}
+
+
+
 # =====================================
 # BORRAR EQUIPO
 # =====================================
@@ -294,6 +647,8 @@ async def delete_equipo(equipo_id: int):
         if result == "DELETE 0":
             raise HTTPException(404, "Equipo no encontrado")
 
+    indice.quitar(equipo_id)
+
     return {"message": "Equipo eliminado"}
 
 
@@ -370,6 +725,73 @@ async def get_ubicaciones():
 
 
 
+# =====================================
+# AUDITORÍA FÍSICA DE UBICACIÓN
+# =====================================
+@app.post("/ubicaciones/{ubicacion_id}/auditoria")
+async def auditar_ubicacion(ubicacion_id: int, data: AuditoriaUbicacion):
+    """
+    Concilia los códigos escaneados en una ubicación contra el inventario.
+    Todo se resuelve en la BD con una sola consulta sobre el arreglo de
+    códigos escaneados.
+    """
+    pool = await get_pool()
+
+    query = """
+        WITH escaneados AS (
+            SELECT DISTINCT unnest($2::text[]) AS codigo
+        ),
+        esperados AS (
+            SELECT id, codigo_inventario, nombre
+            FROM equipos
+            WHERE ubicacion_actual_id = $1
+        )
+        SELECT
+            EXISTS (SELECT 1 FROM ubicaciones WHERE id = $1) AS existe,
+            (SELECT COALESCE(json_agg(json_build_object(
+                        'id', q.id, 'codigo_inventario', q.codigo_inventario, 'nombre', q.nombre
+                    ) ORDER BY q.codigo_inventario), '[]')
+             FROM esperados q
+             JOIN escaneados s ON s.codigo = q.codigo_inventario) AS presentes,
+            (SELECT COALESCE(json_agg(json_build_object(
+                        'id', q.id, 'codigo_inventario', q.codigo_inventario, 'nombre', q.nombre
+                    ) ORDER BY q.codigo_inventario), '[]')
+             FROM esperados q
+             LEFT JOIN escaneados s ON s.codigo = q.codigo_inventario
+             WHERE s.codigo IS NULL) AS faltantes,
+            (SELECT COALESCE(json_agg(json_build_object(
+                        'id', e.id, 'codigo_inventario', e.codigo_inventario, 'nombre', e.nombre,
+                        'ubicacion_registrada_id', e.ubicacion_actual_id,
+                        'ubicacion_registrada', COALESCE(u.edificio, '') || ' - ' || COALESCE(u.aula_oficina, '')
+                    ) ORDER BY e.codigo_inventario), '[]')
+             FROM escaneados s
+             JOIN equipos e ON e.codigo_inventario = s.codigo
+             LEFT JOIN ubicaciones u ON e.ubicacion_actual_id = u.id
+             WHERE e.ubicacion_actual_id IS DISTINCT FROM $1) AS otra_ubicacion,
+            (SELECT COALESCE(json_agg(s.codigo ORDER BY s.codigo), '[]')
+             FROM escaneados s
+             LEFT JOIN equipos e ON e.codigo_inventario = s.codigo
+             WHERE e.id IS NULL) AS no_registrados
+    """
+
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow(query, ubicacion_id, data.codigos)
+
+    if not row["existe"]:
+        raise HTTPException(404, "Ubicación no encontrada")
+
+    resultado = {
+        "presentes": json.loads(row["presentes"]),
+        "faltantes": json.loads(row["faltantes"]),
+        "otra_ubicacion": json.loads(row["otra_ubicacion"]),
+        "no_registrados": json.loads(row["no_registrados"]),
+    }
+    resultado["resumen"] = {k: len(v) for k, v in resultado.items()}
+    resultado["ubicacion_id"] = ubicacion_id
+    return resultado
+
+
+
 # =====================================
 # EXEC DIRECTO
 # =====================================
@@ -1,6 +1,12 @@
-from fastapi import FastAPI, HTTPException
-import psycopg2
+from fastapi import FastAPI, HTTPException, Request
+from pydantic import BaseModel, Field, ValidationError
+from typing import Optional
+from datetime import date
+import asyncpg
+import asyncio
+import csv
 import os
+import tempfile
 
 app = FastAPI(title="Servicio de Mantenimiento", version="1.0.0")
 
@@ -10,44 +16,588 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise RuntimeError("DATABASE_URL no está configurada")
 
-def get_connection():
-    return psycopg2.connect(DATABASE_URL)
+# Tamaño máximo de página en los listados
+MAX_PAGINA = 1000
+
+# Carga masiva: filas validadas/copiadas por lote y errores devueltos como máximo
+LOTE_CARGA = 5000
+MAX_ERRORES = 1000
+
+ESTADOS = ("programado", "en_proceso", "completado", "cancelado")
+PRIORIDADES = ("urgente", "alta", "media", "baja")
+
+# Pool global: se crea una vez en el startup y se reutiliza en cada request
+pool: asyncpg.Pool | None = None
+
+
+@app.on_event("startup")
+async def on_startup():
+    global pool
+    pool = await asyncpg.create_pool(
+        DATABASE_URL,
+        min_size=1,
+        max_size=5
+    )
+    print("✅ Pool creado en mantenimiento_service")
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    global pool
+    if pool is not None:
+        await pool.close()
+        print("🧹 Pool cerrado en mantenimiento_service")
+        pool = None
+
+
+async def get_pool() -> asyncpg.Pool:
+    if pool is None:
+        raise RuntimeError("❌ Pool no inicializado (startup falló)")
+    return pool
+
+# ---- Modelos ----
+
+class ClaimRequest(BaseModel):
+    tecnico_id: int
+
+
+class CompletarRequest(BaseModel):
+    costo: Optional[float] = None
+    descripcion: Optional[str] = None
+    fecha_realizada: Optional[date] = None
+
+
+# Límites de las columnas de mantenimientos (INT, VARCHAR(50), DECIMAL(10,2))
+MAX_INT4 = 2**31 - 1
+
+
+class MantenimientoCarga(BaseModel):
+    equipo_id: int = Field(..., ge=-MAX_INT4 - 1, le=MAX_INT4)
+    fecha_programada: Optional[date] = None
+    fecha_realizada: Optional[date] = None
+    tipo: Optional[str] = Field(None, max_length=50)
+    descripcion: Optional[str] = None
+    costo: Optional[float] = Field(None, lt=1e8)
+    estado: str = "programado"
+    prioridad: str = "media"
+
+
+COLUMNAS_CARGA = list(MantenimientoCarga.__fields__)
+
+
+class PlanCreate(BaseModel):
+    nombre: str
+    categoria_id: Optional[int] = None
+    equipo_ids: Optional[list[int]] = None
+    intervalo_meses: int
+    horizonte_meses: int = 12
+    fecha_inicio: Optional[date] = None
+    tipo: str = "preventivo"
+    prioridad: str = "media"
+    descripcion: Optional[str] = None
+
+
+# Orden de la cola: debe coincidir con idx_mantenimientos_cola
+ORDEN_PRIORIDAD = """
+    CASE prioridad WHEN 'urgente' THEN 1 WHEN 'alta' THEN 2 WHEN 'media' THEN 3 WHEN 'baja' THEN 4 ELSE 5 END
+"""
+NIVELES_PRIORIDAD = 5
 
 # ---- Endpoints ----
 
+@app.get("/health")
+async def health():
+    return {"service": "mantenimiento", "status": "ok"}
+
 @app.get("/mantenimientos")
-def listar_mantenimientos():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        """
+async def listar_mantenimientos(equipo_id: Optional[int] = None,
+                                estado: Optional[str] = None,
+                                prioridad: Optional[str] = None,
+                                tipo: Optional[str] = None,
+                                desde: Optional[date] = None,
+                                hasta: Optional[date] = None,
+                                cursor: Optional[int] = None,
+                                limit: int = 100):
+    """
+    Lista mantenimientos del más reciente al más antiguo con paginación por
+    keyset: 'cursor' es el id del último registro de la página anterior.
+    El rango desde/hasta se aplica sobre fecha_programada.
+    """
+    pool = await get_pool()
+
+    limit = max(1, min(limit, MAX_PAGINA))
+
+    query = """
         SELECT id,
                equipo_id,
                COALESCE(fecha_realizada, fecha_programada, fecha_registro) AS fecha,
+               fecha_programada,
+               fecha_realizada,
                tipo,
-               costo
-        FROM mantenimientos;
-        """
-    )
-    data = cur.fetchall()
-    cur.close()
-    conn.close()
+               descripcion,
+               costo,
+               estado,
+               prioridad
+        FROM mantenimientos
+        WHERE 1=1
+    """
+    params = []
+    px = 1
+
+    for columna, valor in (("equipo_id", equipo_id), ("estado", estado),
+                           ("prioridad", prioridad), ("tipo", tipo)):
+        if valor is not None:
+            query += f" AND {columna} = ${px}"
+            params.append(valor)
+            px += 1
+
+    if desde:
+        query += f" AND fecha_programada >= ${px}"
+        params.append(desde)
+        px += 1
+
+    if hasta:
+        query += f" AND fecha_programada <= ${px}"
+        params.append(hasta)
+        px += 1
+
+    if cursor:
+        query += f" AND id < ${px}"
+        params.append(cursor)
+        px += 1
+
+    query += f" ORDER BY id DESC LIMIT ${px}"
+    params.append(limit)
+
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(query, *params)
+
+    data = [dict(r) for r in rows]
+    siguiente = data[-1]["id"] if len(data) == limit else None
 
-    return {"mantenimientos": data}
+    return {"mantenimientos": data, "siguiente_cursor": siguiente}
 
 @app.post("/mantenimientos")
-def crear_mantenimiento(equipo_id: int, tipo: str, costo: float):
-    conn = get_connection()
-    cur = conn.cursor()
+async def crear_mantenimiento(equipo_id: int, tipo: str, costo: float):
+    pool = await get_pool()
+
+    async with pool.acquire() as conn:
+        new_id = await conn.fetchval(
+            "INSERT INTO mantenimientos (equipo_id, tipo, costo) VALUES ($1, $2, $3) RETURNING id;",
+            equipo_id, tipo, costo
+        )
+
+    return {"message": "Mantenimiento registrado", "id": new_id}
+
+# ---- Cola de trabajo de técnicos ----
+
+@app.post("/mantenimientos/claim")
+async def tomar_mantenimiento(data: ClaimRequest):
+    """
+    Asigna al técnico la orden programada libre y ya vencida de mayor
+    prioridad, la de vencimiento más antiguo. FOR UPDATE SKIP LOCKED hace que
+    los técnicos concurrentes salten las filas que otro está tomando en vez de
+    esperar o duplicar. Se prueba una prioridad por vez: cada intento es un
+    rango de idx_mantenimientos_cola que empieza en la orden vencida más vieja.
+    """
+    pool = await get_pool()
+
+    query = f"""
+        UPDATE mantenimientos m
+        SET tecnico_id = $1, fecha_asignacion = NOW()
+        FROM (
+            SELECT id
+            FROM mantenimientos
+            WHERE estado = 'programado' AND tecnico_id IS NULL
+              AND {ORDEN_PRIORIDAD} = $2
+              AND COALESCE(fecha_programada, DATE '-infinity') <= CURRENT_DATE
+            ORDER BY COALESCE(fecha_programada, DATE '-infinity'), id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        ) libre
+        WHERE m.id = libre.id
+        RETURNING m.*
+    """
+
+    row = None
+    async with pool.acquire() as conn:
+        for prioridad in range(1, NIVELES_PRIORIDAD + 1):
+            try:
+                row = await conn.fetchrow(query, data.tecnico_id, prioridad)
+            except asyncpg.ForeignKeyViolationError:
+                raise HTTPException(status_code=400, detail="Técnico no existe")
+            if row:
+                break
+
+    if not row:
+        raise HTTPException(status_code=404, detail="No hay órdenes pendientes")
+
+    return dict(row)
+
+async def transicionar(mantenimiento_id: int, desde: tuple, set_sql: str, *params):
+    pool = await get_pool()
+
+    query = f"""
+        UPDATE mantenimientos
+        SET {set_sql}
+        WHERE id = $1 AND estado = ANY($2::text[])
+        RETURNING *
+    """
+
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow(query, mantenimiento_id, list(desde), *params)
+        if row:
+            return dict(row)
 
-    cur.execute(
-        "INSERT INTO mantenimientos (equipo_id, tipo, costo) VALUES (%s, %s, %s) RETURNING id;",
-        (equipo_id, tipo, costo)
+        estado = await conn.fetchval(
+            "SELECT estado FROM mantenimientos WHERE id = $1", mantenimiento_id
+        )
+
+    if estado is None:
+        raise HTTPException(status_code=404, detail="Mantenimiento no encontrado")
+    raise HTTPException(status_code=409, detail=f"Transición no permitida desde '{estado}'")
+
+@app.post("/mantenimientos/{mantenimiento_id}/iniciar")
+async def iniciar_mantenimiento(mantenimiento_id: int):
+    return await transicionar(mantenimiento_id, ("programado",), "estado = 'en_proceso'")
+
+@app.post("/mantenimientos/{mantenimiento_id}/completar")
+async def completar_mantenimiento(mantenimiento_id: int, data: CompletarRequest):
+    return await transicionar(
+        mantenimiento_id,
+        ("programado", "en_proceso"),
+        """
+        estado = 'completado',
+        fecha_realizada = COALESCE($3, CURRENT_DATE),
+        costo = COALESCE($4, costo),
+        descripcion = COALESCE($5, descripcion)
+        """,
+        data.fecha_realizada, data.costo, data.descripcion
     )
-    new_id = cur.fetchone()[0]
 
-    conn.commit()
-    cur.close()
-    conn.close()
+@app.post("/mantenimientos/{mantenimiento_id}/cancelar")
+async def cancelar_mantenimiento(mantenimiento_id: int):
+    return await transicionar(mantenimiento_id, ("programado", "en_proceso"), "estado = 'cancelado'")
 
-    return {"message": "Mantenimiento registrado", "id": new_id}
+# ---- Planes de mantenimiento preventivo ----
+
+# Genera las órdenes futuras de los planes indicados hasta su horizonte. Las
+# fechas se anclan en fecha_inicio, así que re-ejecutar produce las mismas
+# filas: NOT EXISTS las descarta sin consumir la secuencia y ON CONFLICT
+# (idx_mantenimientos_plan) cubre expansiones concurrentes.
+EXPANDIR_PLANES = """
+    INSERT INTO mantenimientos (equipo_id, fecha_programada, tipo, descripcion, prioridad, plan_id)
+    SELECT e.id, f.fecha::date, p.tipo, p.descripcion, p.prioridad, p.id
+    FROM planes_mantenimiento p
+    JOIN equipos e
+      ON e.categoria_id = p.categoria_id
+      OR e.id = ANY(p.equipo_ids)
+    CROSS JOIN LATERAL generate_series(
+        p.fecha_inicio,
+        CURRENT_DATE + make_interval(months => p.horizonte_meses),
+        make_interval(months => p.intervalo_meses)
+    ) AS f(fecha)
+    WHERE p.id = ANY($1::int[])
+      AND p.activo
+      AND e.estado_operativo <> 'dado_baja'
+      AND f.fecha >= CURRENT_DATE
+      AND NOT EXISTS (
+          SELECT 1 FROM mantenimientos m
+          WHERE m.plan_id = p.id AND m.equipo_id = e.id AND m.fecha_programada = f.fecha::date
+      )
+    ON CONFLICT (plan_id, equipo_id, fecha_programada) WHERE plan_id IS NOT NULL
+    DO NOTHING
+"""
+
+@app.get("/planes")
+async def listar_planes(activo: Optional[bool] = None):
+    pool = await get_pool()
+
+    query = "SELECT * FROM planes_mantenimiento"
+    params = []
+    if activo is not None:
+        query += " WHERE activo = $1"
+        params.append(activo)
+    query += " ORDER BY nombre"
+
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(query, *params)
+        return [dict(r) for r in rows]
+
+@app.post("/planes")
+async def crear_plan(data: PlanCreate):
+    if data.categoria_id is None and not data.equipo_ids:
+        raise HTTPException(status_code=400, detail="Indique categoria_id o equipo_ids")
+    if data.intervalo_meses <= 0 or data.horizonte_meses <= 0:
+        raise HTTPException(status_code=400, detail="Intervalo y horizonte deben ser positivos")
+
+    pool = await get_pool()
+
+    async with pool.acquire() as conn:
+        try:
+            new_id = await conn.fetchval(
+                """
+                INSERT INTO planes_mantenimiento (
+                    nombre, categoria_id, equipo_ids, intervalo_meses, horizonte_meses,
+                    fecha_inicio, tipo, prioridad, descripcion
+                )
+                VALUES ($1, $2, $3, $4, $5, COALESCE($6, CURRENT_DATE), $7, $8, $9)
+                RETURNING id
+                """,
+                data.nombre, data.categoria_id, data.equipo_ids, data.intervalo_meses,
+                data.horizonte_meses, data.fecha_inicio, data.tipo, data.prioridad,
+                data.descripcion
+            )
+        except asyncpg.ForeignKeyViolationError:
+            raise HTTPException(status_code=400, detail="Categoría no existe")
+
+    return {"id": new_id, "message": "Plan creado exitosamente"}
+
+@app.post("/planes/{plan_id}/expandir")
+async def expandir_plan(plan_id: int):
+    pool = await get_pool()
+
+    async with pool.acquire() as conn:
+        existe = await conn.fetchval("SELECT EXISTS (SELECT 1 FROM planes_mantenimiento WHERE id = $1)", plan_id)
+        if not existe:
+            raise HTTPException(status_code=404, detail="Plan no encontrado")
+
+        result = await conn.execute(EXPANDIR_PLANES, [plan_id])
+
+    return {"plan_id": plan_id, "creados": int(result.split()[-1])}
+
+@app.post("/planes/expandir")
+async def expandir_planes():
+    """Expande todos los planes activos; pensado para un job periódico."""
+    pool = await get_pool()
+
+    async with pool.acquire() as conn:
+        ids = [r["id"] for r in await conn.fetch("SELECT id FROM planes_mantenimiento WHERE activo")]
+        result = await conn.execute(EXPANDIR_PLANES, ids)
+
+    return {"planes": len(ids), "creados": int(result.split()[-1])}
+
+# ---- Carga masiva (JSON o CSV) ----
+
+def validar_fila(fila) -> tuple[Optional[MantenimientoCarga], list[str]]:
+    if not isinstance(fila, dict):
+        return None, ["La fila debe ser un objeto"]
+    # En CSV las celdas vacías equivalen a NULL
+    fila = {k: (None if v == "" else v) for k, v in fila.items() if k is not None}
+    try:
+        item = MantenimientoCarga(**{k: v for k, v in fila.items() if v is not None})
+    except ValidationError as e:
+        return None, [f"{'.'.join(str(x) for x in err['loc'])}: {err['msg']}" for err in e.errors()]
+
+    # PostgreSQL no admite NUL en columnas de texto: COPY rechazaría el lote entero
+    errores = [f"{k}: contiene el carácter NUL" for k, v in fila.items() if isinstance(v, str) and "\x00" in v]
+    if item.estado not in ESTADOS:
+        errores.append(f"estado: debe ser uno de {', '.join(ESTADOS)}")
+    if item.prioridad not in PRIORIDADES:
+        errores.append(f"prioridad: debe ser uno de {', '.join(PRIORIDADES)}")
+    if item.costo is not None and item.costo < 0:
+        errores.append("costo: no puede ser negativo")
+    return (None if errores else item), errores
+
+async def copiar_filas(conn, validos: list) -> tuple[int, list]:
+    """
+    Copia con COPY las filas ya validadas cuyo equipo existe. Los equipos se
+    verifican en una sola consulta. Devuelve (insertadas, errores por fila).
+    """
+    ids = list({item.equipo_id for _, item in validos})
+    existentes = {r["id"] for r in await conn.fetch("SELECT id FROM equipos WHERE id = ANY($1::int[])", ids)}
+
+    registros = []
+    errores = []
+    for num, item in validos:
+        if item.equipo_id not in existentes:
+            errores.append((num, [f"equipo_id: el equipo {item.equipo_id} no existe"]))
+            continue
+        registros.append(tuple(getattr(item, c) for c in COLUMNAS_CARGA))
+
+    if registros:
+        await conn.copy_records_to_table("mantenimientos", records=registros, columns=COLUMNAS_CARGA)
+    return len(registros), errores
+
+async def cargar_lote(conn, lote: list, resultado: dict):
+    """
+    Valida un lote de (número de fila, datos) y copia las filas válidas. Cada
+    lote va en un savepoint: si la BD rechaza un valor que la validación no
+    detectó, se reintentan sus filas una por una para informar cuáles fallan
+    sin abortar la carga.
+    """
+    validos = []
+    for num, fila in lote:
+        item, errores = validar_fila(fila)
+        if errores:
+            registrar_errores(resultado, num, errores)
+        else:
+            validos.append((num, item))
+
+    try:
+        async with conn.transaction():
+            insertados, errores = await copiar_filas(conn, validos)
+    except (asyncpg.DataError, OverflowError):
+        insertados, errores = 0, []
+        for num, item in validos:
+            try:
+                async with conn.transaction():
+                    n, errores_fila = await copiar_filas(conn, [(num, item)])
+            except (asyncpg.DataError, OverflowError) as e:
+                n, errores_fila = 0, [(num, [f"rechazada por la base de datos: {str(e)}"])]
+            insertados += n
+            errores += errores_fila
+
+    resultado["insertados"] += insertados
+    for num, errores_fila in errores:
+        registrar_errores(resultado, num, errores_fila)
+
+def registrar_errores(resultado: dict, num: int, errores: list):
+    resultado["filas_con_error"] += 1
+    if len(resultado["errores"]) < MAX_ERRORES:
+        resultado["errores"].append({"fila": num, "errores": errores})
+
+async def filas_csv(request: Request):
+    # El cuerpo se vuelca a un archivo temporal a medida que llega, para no
+    # tenerlo entero en memoria; luego se lee con DictReader.
+    with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as tmp:
+        async for chunk in request.stream():
+            tmp.write(chunk)
+        tmp.seek(0)
+        # Se decodifica línea por línea para que un byte inválido se informe
+        # en la fila donde aparece
+        lineas = (linea.decode("utf-8-sig" if i == 0 else "utf-8") for i, linea in enumerate(tmp))
+        lector = csv.DictReader(lineas)
+        # Fila 1 es la cabecera
+        num = 1
+        while True:
+            try:
+                fila = next(lector)
+            except StopIteration:
+                return
+            except UnicodeDecodeError:
+                # line_num todavía no cuenta la línea que falló
+                raise HTTPException(status_code=400, detail=f"CSV inválido en la fila {lector.line_num + 1}: no es UTF-8")
+            except csv.Error as e:
+                raise HTTPException(status_code=400, detail=f"CSV inválido en la fila {lector.line_num + 1}: {str(e)}")
+            num += 1
+            yield num, fila
+
+async def filas_json(request: Request):
+    try:
+        data = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="JSON inválido")
+    if not isinstance(data, list):
+        raise HTTPException(status_code=400, detail="Se esperaba un arreglo JSON")
+    for num, fila in enumerate(data, start=1):
+        yield num, fila
+
+@app.post("/mantenimientos/bulk")
+async def carga_masiva(request: Request, atomico: bool = False):
+    """
+    Registra mantenimientos en bloque desde un arreglo JSON o un CSV
+    (Content-Type: text/csv) con los mismos campos. Las filas inválidas se
+    informan por número; con atomico=true cualquier error revierte la carga.
+    """
+    pool = await get_pool()
+
+    content_type = request.headers.get("content-type", "")
+    filas = filas_csv(request) if content_type.startswith("text/csv") else filas_json(request)
+
+    resultado = {"insertados": 0, "filas_con_error": 0, "errores": []}
+
+    async with pool.acquire() as conn:
+        tr = conn.transaction()
+        await tr.start()
+        try:
+            lote = []
+            async for num, fila in filas:
+                lote.append((num, fila))
+                if len(lote) >= LOTE_CARGA:
+                    await cargar_lote(conn, lote, resultado)
+                    lote = []
+                    # Cede el event loop entre lotes
+                    await asyncio.sleep(0)
+            if lote:
+                await cargar_lote(conn, lote, resultado)
+        except BaseException:
+            await tr.rollback()
+            raise
+
+        if atomico and resultado["filas_con_error"]:
+            await tr.rollback()
+            resultado["insertados"] = 0
+            resultado["revertido"] = True
+        else:
+            await tr.commit()
+
+    resultado["errores"].sort(key=lambda e: e["fila"])
+    return resultado
+
+# ---- Resumen de costos por equipo y mes ----
+# mantenimientos_resumen_mensual se mantiene con triggers en la BD (ver schema.sql)
+
+@app.get("/resumen/equipos/{equipo_id}")
+async def resumen_equipo(equipo_id: int, meses: bool = False):
+    """
+    Totales históricos de mantenimiento de un equipo leídos del resumen
+    mensual (búsqueda por clave primaria, sin recorrer mantenimientos).
+    """
+    pool = await get_pool()
+
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(
+            """
+            SELECT mes, cantidad, costo_total
+            FROM mantenimientos_resumen_mensual
+            WHERE equipo_id = $1
+            ORDER BY mes
+            """,
+            equipo_id
+        )
+
+    resultado = {
+        "equipo_id": equipo_id,
+        "cantidad": sum(r["cantidad"] for r in rows),
+        "costo_total": float(sum(r["costo_total"] for r in rows)),
+        "primer_mes": rows[0]["mes"] if rows else None,
+        "ultimo_mes": rows[-1]["mes"] if rows else None,
+    }
+    if meses:
+        resultado["meses"] = [
+            {"mes": r["mes"], "cantidad": r["cantidad"], "costo_total": float(r["costo_total"])}
+            for r in rows
+        ]
+    return resultado
+
+@app.get("/resumen/mensual")
+async def resumen_mensual(desde: Optional[date] = None, hasta: Optional[date] = None):
+    pool = await get_pool()
+
+    query = """
+        SELECT mes, SUM(cantidad) AS cantidad, SUM(costo_total) AS costo_total
+        FROM mantenimientos_resumen_mensual
+        WHERE ($1::date IS NULL OR mes >= date_trunc('month', $1::date))
+          AND ($2::date IS NULL OR mes <= $2::date)
+        GROUP BY mes
+        ORDER BY mes
+    """
+
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(query, desde, hasta)
+
+    return [
+        {"mes": r["mes"], "cantidad": r["cantidad"], "costo_total": float(r["costo_total"])}
+        for r in rows
+    ]
+
+@app.post("/resumen/reconstruir")
+async def reconstruir_resumen():
+    pool = await get_pool()
+
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            filas = await conn.fetchval("SELECT reconstruir_resumen_mantenimientos()")
+
+    return {"filas": filas, "message": "Resumen reconstruido"}
@@ -4,6 +4,10 @@ from typing import Optional
 import asyncpg
 import os
 from datetime import date
+from decimal import Decimal
+import asyncio
+import json
+import time
 
 app = FastAPI(title="Proveedores Service", version="1.0.0")
 
@@ -11,23 +15,47 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise RuntimeError("DATABASE_URL no está configurada para proveedores_service")     
 
+# Refresco de estado de contratos: cada cuánto corre, tamaño de lote y pausa entre lotes
+CONTRATOS_REFRESCO_MINUTOS = float(os.getenv("CONTRATOS_REFRESCO_MINUTOS", "60"))
+CONTRATOS_LOTE = int(os.getenv("CONTRATOS_LOTE", "500"))
+CONTRATOS_PAUSA_MS = int(os.getenv("CONTRATOS_PAUSA_MS", "100"))
+
+# Segundos que se sirve el scorecard cacheado antes de recalcularlo en segundo plano
+SCORECARD_TTL_SEGUNDOS = float(os.getenv("SCORECARD_TTL_SEGUNDOS", "300"))
+
 # Pool global para evitar demasiadas conexiones
 pool: asyncpg.Pool | None = None
+tarea_refresco: asyncio.Task | None = None
+# Tareas sueltas en curso (refrescos del scorecard)
+tareas_fondo: set[asyncio.Task] = set()
 
 @app.on_event("startup")
 async def on_startup():
-    global pool
+    global pool, tarea_refresco
     if not DATABASE_URL:
         raise RuntimeError("DATABASE_URL no está configurada")
     pool = await asyncpg.create_pool(DATABASE_URL, min_size=1, max_size=5)
+    # Precalienta el scorecard para que la primera consulta no espere
+    en_segundo_plano(refrescar_scorecard_seguro())
+    if CONTRATOS_REFRESCO_MINUTOS > 0:
+        tarea_refresco = asyncio.create_task(ciclo_refresco_contratos())
 
 @app.on_event("shutdown")
 async def on_shutdown():
-    global pool
+    global pool, tarea_refresco
+    if tarea_refresco is not None:
+        tarea_refresco.cancel()
+        tarea_refresco = None
     if pool is not None:
         await pool.close()
         pool = None
 
+def en_segundo_plano(coro):
+    """Lanza coro como tarea y guarda la referencia hasta que termine: el event loop solo guarda referencias débiles."""
+    tarea = asyncio.create_task(coro)
+    tareas_fondo.add(tarea)
+    tarea.add_done_callback(tareas_fondo.discard)
+
 async def get_db_pool() -> asyncpg.Pool:
     global pool
     if pool is None:
@@ -71,59 +99,410 @@ async def health_check():
     return {"status": "healthy", "service": "proveedores"}
 
 @app.get("/proveedores")
-async def get_proveedores(activo: Optional[bool] = None):
+async def get_proveedores(activo: Optional[bool] = None,
+                          q: Optional[str] = None,
+                          estadisticas: bool = False,
+                          limit: Optional[int] = None,
+                          offset: int = 0):
+    """
+    Lista proveedores. 'q' busca por razón social o RUC (índices trigram).
+    Con estadisticas=true agrega, en la misma consulta, equipos comprados,
+    total de compras, contratos vigentes y próximo vencimiento.
+    """
     pool = await get_db_pool()
     
-    query = "SELECT * FROM proveedores"
+    conds = []
     params = []
     
     if activo is not None:
-        query += " WHERE activo = $1"
         params.append(activo)
+        conds.append(f"activo = ${len(params)}")
+    
+    if q:
+        # % y _ del texto se buscan literalmente
+        patron = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        params.append(f"%{patron}%")
+        conds.append(f"(razon_social ILIKE ${len(params)} ESCAPE '\\' OR ruc ILIKE ${len(params)} ESCAPE '\\')")
+    
+    query = "SELECT * FROM proveedores"
+    if conds:
+        query += " WHERE " + " AND ".join(conds)
+    
+    query += " ORDER BY razon_social, id"
+    
+    if limit is not None:
+        params.append(max(1, min(limit, 1000)))
+        query += f" LIMIT ${len(params)}"
+        params.append(max(0, offset))
+        query += f" OFFSET ${len(params)}"
     
-    query += " ORDER BY razon_social"
+    if estadisticas:
+        query = f"""
+            WITH pagina AS ({query})
+            SELECT pagina.*,
+                   COALESCE(eq.total_equipos, 0) AS total_equipos,
+                   COALESCE(eq.total_comprado, 0) AS total_comprado,
+                   COALESCE(ct.contratos_vigentes, 0) AS contratos_vigentes,
+                   ct.proximo_vencimiento
+            FROM pagina
+            LEFT JOIN (
+                SELECT proveedor_id,
+                       COUNT(*) AS total_equipos,
+                       SUM(costo_compra) AS total_comprado
+                FROM equipos
+                WHERE proveedor_id IN (SELECT id FROM pagina)
+                GROUP BY proveedor_id
+            ) eq ON eq.proveedor_id = pagina.id
+            LEFT JOIN (
+                SELECT proveedor_id,
+                       COUNT(*) AS contratos_vigentes,
+                       MIN(fecha_fin) AS proximo_vencimiento
+                FROM contratos
+                WHERE proveedor_id IN (SELECT id FROM pagina)
+                  AND estado = 'vigente'
+                  AND fecha_fin >= CURRENT_DATE
+                GROUP BY proveedor_id
+            ) ct ON ct.proveedor_id = pagina.id
+            ORDER BY pagina.razon_social, pagina.id
+        """
     
     async with pool.acquire() as conn:
         rows = await conn.fetch(query, *params)
         return [dict(row) for row in rows]
 
+# Métricas por proveedor en una sola pasada agrupada. Solo cuentan los
+# mantenimientos completados: los programados a futuro por los planes y los
+# cancelados reflejan la configuración, no el desempeño de los equipos.
+SCORECARD_QUERY = """
+    WITH eq AS (
+        SELECT proveedor_id,
+               COUNT(*) AS equipos,
+               COALESCE(SUM(costo_compra), 0) AS costo_compra_total,
+               COUNT(*) FILTER (WHERE estado_operativo IN ('en_reparacion', 'obsoleto')) AS equipos_con_problemas
+        FROM equipos
+        WHERE proveedor_id IS NOT NULL
+        GROUP BY proveedor_id
+    ),
+    mt AS (
+        SELECT e.proveedor_id,
+               COUNT(*) AS mantenimientos,
+               COALESCE(SUM(m.costo), 0) AS costo_mantenimiento
+        FROM mantenimientos m
+        JOIN equipos e ON e.id = m.equipo_id
+        WHERE m.estado = 'completado'
+          AND e.proveedor_id IS NOT NULL
+        GROUP BY e.proveedor_id
+    ),
+    ct AS (
+        SELECT proveedor_id,
+               COUNT(*) AS contratos,
+               COALESCE(SUM(monto_total), 0) AS gasto_contratos
+        FROM contratos
+        GROUP BY proveedor_id
+    )
+    SELECT p.id AS proveedor_id,
+           p.razon_social,
+           p.calificacion,
+           COALESCE(eq.equipos, 0) AS equipos,
+           COALESCE(eq.costo_compra_total, 0) AS costo_compra_total,
+           COALESCE(mt.mantenimientos, 0) AS mantenimientos,
+           COALESCE(mt.costo_mantenimiento, 0) AS costo_mantenimiento,
+           COALESCE(ct.contratos, 0) AS contratos,
+           COALESCE(ct.gasto_contratos, 0) AS gasto_contratos,
+           ROUND(COALESCE(mt.mantenimientos, 0)::numeric / NULLIF(eq.equipos, 0), 4)
+               AS mantenimientos_por_equipo,
+           ROUND(COALESCE(mt.costo_mantenimiento, 0) / NULLIF(eq.costo_compra_total, 0), 4)
+               AS ratio_costo_mantenimiento,
+           ROUND(eq.equipos_con_problemas::numeric / NULLIF(eq.equipos, 0), 4)
+               AS ratio_equipos_con_problemas
+    FROM proveedores p
+    LEFT JOIN eq ON eq.proveedor_id = p.id
+    LEFT JOIN mt ON mt.proveedor_id = p.id
+    LEFT JOIN ct ON ct.proveedor_id = p.id
+"""
+
+# Granularidades de la línea de tiempo de gasto -> (unidad de date_trunc, paso)
+GRANULARIDADES = {
+    "mes": ("month", "1 month"),
+    "trimestre": ("quarter", "3 months"),
+    "anio": ("year", "1 year"),
+}
+MAX_PERIODOS = 600
+
+# Rango alineado a períodos completos y serie densa de períodos. Los filtros
+# sobre fecha_compra / fecha_inicio son rangos simples (sargables) para usar
+# idx_equipos_proveedor_compra, idx_equipos_compra e idx_contratos_*.
+GASTO_RANGO = """
+    WITH rango AS (
+        SELECT date_trunc($1::text, $2::date)::date AS desde,
+               (date_trunc($1::text, $3::date) + $4::text::interval)::date AS hasta
+    ),
+    periodos AS (
+        SELECT generate_series(r.desde, r.hasta - 1, $4::text::interval)::date AS periodo
+        FROM rango r
+    ),
+    compras AS (
+        SELECT e.proveedor_id,
+               date_trunc($1::text, e.fecha_compra)::date AS periodo,
+               COUNT(*) AS equipos,
+               SUM(e.costo_compra) AS compras
+        FROM equipos e, rango r
+        WHERE e.fecha_compra >= r.desde AND e.fecha_compra < r.hasta
+          AND e.proveedor_id IS NOT NULL {filtro_equipos}
+        GROUP BY 1, 2
+    ),
+    gasto_contratos AS (
+        SELECT c.proveedor_id,
+               date_trunc($1::text, c.fecha_inicio)::date AS periodo,
+               SUM(c.monto_total) AS contratos
+        FROM contratos c, rango r
+        WHERE c.fecha_inicio >= r.desde AND c.fecha_inicio < r.hasta {filtro_contratos}
+        GROUP BY 1, 2
+    )
+"""
+
+GASTO_PROVEEDOR = GASTO_RANGO.format(
+    filtro_equipos="AND e.proveedor_id = $5",
+    filtro_contratos="AND c.proveedor_id = $5",
+) + """
+    SELECT per.periodo,
+           COALESCE(co.equipos, 0) AS equipos,
+           COALESCE(co.compras, 0) AS compras,
+           COALESCE(gc.contratos, 0) AS contratos
+    FROM periodos per
+    LEFT JOIN compras co ON co.periodo = per.periodo
+    LEFT JOIN gasto_contratos gc ON gc.periodo = per.periodo
+    ORDER BY per.periodo
+"""
+
+GASTO_TODOS = GASTO_RANGO.format(filtro_equipos="", filtro_contratos="") + """,
+    con_gasto AS (
+        SELECT p.id AS proveedor_id, p.razon_social
+        FROM proveedores p
+        WHERE p.id IN (SELECT proveedor_id FROM compras UNION SELECT proveedor_id FROM gasto_contratos)
+    )
+    SELECT per.periodo,
+           cg.proveedor_id,
+           cg.razon_social,
+           COALESCE(co.equipos, 0) AS equipos,
+           COALESCE(co.compras, 0) AS compras,
+           COALESCE(gc.contratos, 0) AS contratos
+    FROM periodos per
+    LEFT JOIN con_gasto cg ON TRUE
+    LEFT JOIN compras co ON co.proveedor_id = cg.proveedor_id AND co.periodo = per.periodo
+    LEFT JOIN gasto_contratos gc ON gc.proveedor_id = cg.proveedor_id AND gc.periodo = per.periodo
+    ORDER BY cg.razon_social, cg.proveedor_id, per.periodo
+"""
+
+def rango_gasto(desde: Optional[date], hasta: Optional[date], granularidad: str):
+    if granularidad not in GRANULARIDADES:
+        raise HTTPException(status_code=400, detail=f"granularidad debe ser uno de: {', '.join(GRANULARIDADES)}")
+    hasta = hasta or date.today()
+    desde = desde or date(hasta.year - 2, 1, 1)
+    if desde > hasta:
+        raise HTTPException(status_code=400, detail="'desde' debe ser anterior a 'hasta'")
+    meses = {"mes": 1, "trimestre": 3, "anio": 12}[granularidad]
+    if ((hasta.year - desde.year) * 12 + hasta.month - desde.month) // meses + 1 > MAX_PERIODOS:
+        raise HTTPException(status_code=400, detail=f"El rango supera {MAX_PERIODOS} períodos")
+    unidad, paso = GRANULARIDADES[granularidad]
+    return unidad, paso, desde, hasta
+
+@app.get("/proveedores/gasto")
+async def get_gasto_proveedores(desde: Optional[date] = None,
+                                hasta: Optional[date] = None,
+                                granularidad: str = "mes"):
+    """
+    Gasto por período de todos los proveedores con compras o contratos en
+    el rango. Cada serie está alineada con 'periodos' y rellena con ceros.
+    """
+    unidad, paso, desde, hasta = rango_gasto(desde, hasta, granularidad)
+    pool = await get_db_pool()
+
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(GASTO_TODOS, unidad, desde, hasta, paso)
+
+    periodos = sorted({r["periodo"] for r in rows})
+    proveedores = {}
+    for r in rows:
+        if r["proveedor_id"] is None:
+            continue
+        serie = proveedores.setdefault(r["proveedor_id"], {
+            "proveedor_id": r["proveedor_id"],
+            "razon_social": r["razon_social"],
+            "equipos": [],
+            "compras": [],
+            "contratos": [],
+        })
+        serie["equipos"].append(r["equipos"])
+        serie["compras"].append(float(r["compras"]))
+        serie["contratos"].append(float(r["contratos"]))
+
+    return {
+        "granularidad": granularidad,
+        "desde": desde,
+        "hasta": hasta,
+        "periodos": periodos,
+        "proveedores": list(proveedores.values()),
+    }
+
+@app.get("/proveedores/{proveedor_id}/gasto")
+async def get_gasto_proveedor(proveedor_id: int,
+                              desde: Optional[date] = None,
+                              hasta: Optional[date] = None,
+                              granularidad: str = "mes"):
+    unidad, paso, desde, hasta = rango_gasto(desde, hasta, granularidad)
+    pool = await get_db_pool()
+
+    async with pool.acquire() as conn:
+        razon_social = await conn.fetchval("SELECT razon_social FROM proveedores WHERE id = $1", proveedor_id)
+        if razon_social is None:
+            raise HTTPException(status_code=404, detail="Proveedor no encontrado")
+        rows = await conn.fetch(GASTO_PROVEEDOR, unidad, desde, hasta, paso, proveedor_id)
+
+    return {
+        "proveedor_id": proveedor_id,
+        "razon_social": razon_social,
+        "granularidad": granularidad,
+        "desde": desde,
+        "hasta": hasta,
+        "serie": [
+            {
+                "periodo": r["periodo"],
+                "equipos": r["equipos"],
+                "compras": float(r["compras"]),
+                "contratos": float(r["contratos"]),
+                "total": float(r["compras"] + r["contratos"]),
+            }
+            for r in rows
+        ],
+    }
+
+# Métricas por las que se puede ordenar el ranking (menor es mejor salvo gasto)
+ORDENES_SCORECARD = (
+    "ratio_costo_mantenimiento",
+    "mantenimientos_por_equipo",
+    "ratio_equipos_con_problemas",
+    "gasto_contratos",
+)
+
+scorecard_cache = {"datos": None, "calculado_en": 0.0, "duracion_ms": None}
+scorecard_lock = asyncio.Lock()
+
+async def refrescar_scorecard():
+    # Si otro request ya está recalculando, se espera a ese resultado
+    if scorecard_lock.locked():
+        async with scorecard_lock:
+            return
+    async with scorecard_lock:
+        pool = await get_db_pool()
+        t0 = time.perf_counter()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(SCORECARD_QUERY)
+        scorecard_cache["datos"] = [
+            {k: float(v) if isinstance(v, Decimal) else v for k, v in r.items()}
+            for r in rows
+        ]
+        scorecard_cache["calculado_en"] = time.time()
+        scorecard_cache["duracion_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+
+async def refrescar_scorecard_seguro():
+    """refrescar_scorecard para tareas en segundo plano: registra el error en vez de perderlo."""
+    try:
+        await refrescar_scorecard()
+    except Exception as e:
+        print(f"❌ Error recalculando scorecard: {e}")
+
+@app.get("/proveedores/scorecard")
+async def get_scorecard(orden: str = "ratio_costo_mantenimiento"):
+    """
+    Ranking de proveedores según el desempeño de sus equipos. Se sirve
+    desde memoria; si el cálculo superó SCORECARD_TTL_SEGUNDOS se devuelve
+    igual y se recalcula en segundo plano.
+    """
+    if orden not in ORDENES_SCORECARD:
+        raise HTTPException(status_code=400, detail=f"orden debe ser uno de: {', '.join(ORDENES_SCORECARD)}")
+
+    if scorecard_cache["datos"] is None:
+        await refrescar_scorecard_seguro()
+        # Falló este cálculo o el que se esperó
+        if scorecard_cache["datos"] is None:
+            raise HTTPException(status_code=503, detail="Scorecard no disponible, reintente en unos segundos")
+    elif time.time() - scorecard_cache["calculado_en"] > SCORECARD_TTL_SEGUNDOS and not scorecard_lock.locked():
+        en_segundo_plano(refrescar_scorecard_seguro())
+
+    # Sin datos (proveedores sin equipos) al final; el gasto se ordena de mayor a menor
+    descendente = orden == "gasto_contratos"
+    con_valor = [d for d in scorecard_cache["datos"] if d[orden] is not None]
+    sin_valor = [d for d in scorecard_cache["datos"] if d[orden] is None]
+    ranking = sorted(con_valor, key=lambda d: d[orden], reverse=descendente) + sin_valor
+
+    return {
+        "orden": orden,
+        "calculado_en": scorecard_cache["calculado_en"],
+        "antiguedad_segundos": round(time.time() - scorecard_cache["calculado_en"], 1),
+        "duracion_calculo_ms": scorecard_cache["duracion_ms"],
+        "proveedores": [{"posicion": i + 1, **d} for i, d in enumerate(ranking)],
+    }
+
+@app.post("/proveedores/scorecard/refrescar")
+async def post_refrescar_scorecard():
+    await refrescar_scorecard()
+    return {"calculado_en": scorecard_cache["calculado_en"], "message": "Scorecard recalculado"}
+
+# Proveedor, estadísticas de compras y una página de contratos en una sola
+# consulta (subconsultas LATERAL + json_agg) en lugar de tres viajes a la BD.
+PROVEEDOR_DETALLE = """
+    SELECT p.*,
+           json_build_object('total', s.total, 'total_comprado', s.total_comprado)::text
+               AS estadisticas_compras,
+           ct.total AS contratos_total,
+           c.contratos::text AS contratos
+    FROM proveedores p
+    CROSS JOIN LATERAL (
+        SELECT COUNT(*) AS total, SUM(costo_compra) AS total_comprado
+        FROM equipos
+        WHERE proveedor_id = p.id
+    ) s
+    CROSS JOIN LATERAL (
+        SELECT COUNT(*) AS total
+        FROM contratos
+        WHERE proveedor_id = p.id
+    ) ct
+    CROSS JOIN LATERAL (
+        SELECT COALESCE(json_agg(pag ORDER BY pag.fecha_inicio DESC, pag.id DESC), '[]') AS contratos
+        FROM (
+            SELECT *
+            FROM contratos
+            WHERE proveedor_id = p.id
+            ORDER BY fecha_inicio DESC, id DESC
+            LIMIT $2 OFFSET $3
+        ) pag
+    ) c
+    WHERE p.id = $1
+"""
+
 @app.get("/proveedores/{proveedor_id}")
-async def get_proveedor(proveedor_id: int):
+async def get_proveedor(proveedor_id: int, contratos_limit: int = 50, contratos_offset: int = 0):
     pool = await get_db_pool()
-    
+
+    contratos_limit = max(1, min(contratos_limit, 500))
+    contratos_offset = max(0, contratos_offset)
+
     async with pool.acquire() as conn:
         proveedor = await conn.fetchrow(
-            "SELECT * FROM proveedores WHERE id = $1",
-            proveedor_id
-        )
-        
-        if not proveedor:
-            raise HTTPException(status_code=404, detail="Proveedor no encontrado")
-        
-        resultado = dict(proveedor)
-        
-        equipos = await conn.fetch(
-            """
-            SELECT COUNT(*) as total, 
-                   SUM(costo_compra) as total_comprado
-            FROM equipos 
-            WHERE proveedor_id = $1
-            """,
-            proveedor_id
-        )
-        resultado['estadisticas_compras'] = dict(equipos[0])
-        
-        contratos = await conn.fetch(
-            """
-            SELECT * FROM contratos 
-            WHERE proveedor_id = $1 
-            ORDER BY fecha_inicio DESC
-            """,
-            proveedor_id
+            PROVEEDOR_DETALLE, proveedor_id, contratos_limit, contratos_offset
         )
-        resultado['contratos'] = [dict(c) for c in contratos]
-        
-        return resultado
+
+    if not proveedor:
+        raise HTTPException(status_code=404, detail="Proveedor no encontrado")
+
+    resultado = dict(proveedor)
+    resultado['estadisticas_compras'] = json.loads(resultado['estadisticas_compras'])
+    resultado['contratos'] = json.loads(resultado['contratos'])
+    resultado['contratos_limit'] = contratos_limit
+    resultado['contratos_offset'] = contratos_offset
+
+    return resultado
 
 @app.post("/proveedores")
 async def create_proveedor(proveedor: ProveedorCreate):
@@ -202,6 +581,73 @@ async def get_contratos(proveedor_id: Optional[int] = None):
         rows = await conn.fetch(query, *params)
         return [dict(row) for row in rows]
 
+@app.get("/contratos/por-vencer")
+async def get_contratos_por_vencer(dias: int = 30):
+    """Contratos vigentes que vencen en los próximos 'dias' (idx_contratos_vigentes_fin)."""
+    pool = await get_db_pool()
+    
+    query = """
+        SELECT c.*, p.razon_social as proveedor_nombre,
+               c.fecha_fin - CURRENT_DATE as dias_restantes
+        FROM contratos c
+        JOIN proveedores p ON c.proveedor_id = p.id
+        WHERE c.estado = 'vigente'
+          AND c.fecha_fin >= CURRENT_DATE
+          AND c.fecha_fin <= CURRENT_DATE + $1::int
+        ORDER BY c.fecha_fin, c.id
+    """
+    
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(query, max(0, dias))
+        return [dict(row) for row in rows]
+
+async def refrescar_estados_contratos() -> int:
+    """
+    Marca como 'vencido' los contratos vigentes cuya fecha_fin ya pasó, en
+    lotes de CONTRATOS_LOTE con una pausa entre lotes para no competir con
+    el tráfico normal. Cada lote es una transacción corta.
+    """
+    pool = await get_db_pool()
+    total = 0
+    
+    while True:
+        async with pool.acquire() as conn:
+            result = await conn.execute(
+                """
+                UPDATE contratos
+                SET estado = 'vencido'
+                WHERE id IN (
+                    SELECT id FROM contratos
+                    WHERE estado = 'vigente' AND fecha_fin < CURRENT_DATE
+                    LIMIT $1
+                    FOR UPDATE SKIP LOCKED
+                )
+                """,
+                CONTRATOS_LOTE
+            )
+        actualizados = int(result.split()[-1])
+        total += actualizados
+        if actualizados < CONTRATOS_LOTE:
+            return total
+        await asyncio.sleep(CONTRATOS_PAUSA_MS / 1000)
+
+async def ciclo_refresco_contratos():
+    while True:
+        try:
+            total = await refrescar_estados_contratos()
+            if total:
+                print(f"🔄 Contratos marcados como vencidos: {total}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ Error refrescando contratos: {e}")
+        await asyncio.sleep(CONTRATOS_REFRESCO_MINUTOS * 60)
+
+@app.post("/contratos/refrescar-estados")
+async def post_refrescar_estados():
+    total = await refrescar_estados_contratos()
+    return {"vencidos": total, "message": "Estados de contratos actualizados"}
+
 @app.post("/contratos")
 async def create_contrato(contrato: ContratoCreate):
     pool = await get_db_pool()
@@ -1,15 +1,32 @@
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response
+from pydantic import BaseModel
 from typing import Optional
 import asyncpg
+import asyncio
+import csv
+import gzip
+import hashlib
+import json
+import multiprocessing
 import os
+import tempfile
+import time
 from fastapi.responses import StreamingResponse
-from datetime import datetime, date
-import pandas as pd
+from starlette.background import BackgroundTask
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict
+from functools import lru_cache
+from datetime import datetime, date, timezone
+import numpy as np
+import xlsxwriter
+import pyarrow as pa
+import pyarrow.parquet as pq
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.lib import colors
 from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.platypus import SimpleDocTemplate, LongTable, TableStyle, Paragraph, Spacer
 from reportlab.lib.styles import getSampleStyleSheet
 import io
 from pathlib import Path
@@ -21,23 +38,87 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise RuntimeError("❌ DATABASE_URL no está configurado. Render no podrá conectar a la base de datos.")
 
+# Segundos que se sirve el dashboard cacheado antes de recalcularlo en segundo plano
+DASHBOARD_TTL_SEGUNDOS = float(os.getenv("DASHBOARD_TTL_SEGUNDOS", "5"))
+
+# Cada cuántos minutos se refrescan las vistas materializadas (0 = solo a pedido)
+VISTAS_REFRESCO_MINUTOS = float(os.getenv("VISTAS_REFRESCO_MINUTOS", "10"))
+
+# Snapshot en memoria de equipos para los reportes de distribución: si está
+# activo, cada cuántos segundos se aplican los cambios y horas de retención
+# del feed equipos_cambios
+SNAPSHOT_FLOTA = os.getenv("SNAPSHOT_FLOTA", "1") == "1"
+SNAPSHOT_INTERVALO_SEGUNDOS = float(os.getenv("SNAPSHOT_INTERVALO_SEGUNDOS", "5"))
+CAMBIOS_RETENCION_HORAS = float(os.getenv("CAMBIOS_RETENCION_HORAS", "24"))
+
+# Exportación a Excel: filas por lote del cursor y filas usadas para estimar anchos
+EXPORT_LOTE = int(os.getenv("EXPORT_LOTE", "5000"))
+EXPORT_MUESTRA_ANCHOS = 200
+
+# Procesos dedicados a renderizar PDFs (reportlab es CPU puro)
+PDF_PROCESOS = int(os.getenv("PDF_PROCESOS", "2"))
+
+# Trabajos de exportación: directorio de resultados, workers, largo máximo de
+# la cola y límites del directorio (se borran los archivos usados hace más tiempo)
+REPORTS_PATH = Path(os.getenv("REPORTS_PATH", "/app/reportes"))
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "2"))
+EXPORT_COLA_MAX = int(os.getenv("EXPORT_COLA_MAX", "50"))
+EXPORT_CACHE_MB = float(os.getenv("EXPORT_CACHE_MB", "500"))
+EXPORT_CACHE_ARCHIVOS = int(os.getenv("EXPORT_CACHE_ARCHIVOS", "200"))
 
 # Pool global para evitar demasiadas conexiones
 pool: asyncpg.Pool | None = None
+tarea_vistas: asyncio.Task | None = None
+tarea_snapshot: asyncio.Task | None = None
+tarea_depuracion: asyncio.Task | None = None
+pdf_executor: ProcessPoolExecutor | None = None
+workers_exportacion: list[asyncio.Task] = []
+# Tareas sueltas en curso (refrescos del dashboard)
+tareas_fondo: set[asyncio.Task] = set()
 
 @app.on_event("startup")
 async def on_startup():
-    global pool
+    global pool, tarea_vistas, tarea_snapshot, tarea_depuracion
     # Limitar el tamaño del pool para prevenir TooManyConnectionsError
     pool = await asyncpg.create_pool(DATABASE_URL, min_size=1, max_size=5)
+    get_pdf_executor()
+    if VISTAS_REFRESCO_MINUTOS > 0:
+        tarea_vistas = asyncio.create_task(ciclo_refresco_vistas())
+    if SNAPSHOT_FLOTA:
+        tarea_snapshot = asyncio.create_task(ciclo_snapshot())
+    # Los triggers escriben el feed siempre, aunque el snapshot esté desactivado
+    tarea_depuracion = asyncio.create_task(ciclo_depuracion_cambios())
+    REPORTS_PATH.mkdir(parents=True, exist_ok=True)
+    workers_exportacion.extend(asyncio.create_task(worker_exportacion()) for _ in range(EXPORT_WORKERS))
 
 @app.on_event("shutdown")
 async def on_shutdown():
-    global pool
+    global pool, tarea_vistas, tarea_snapshot, tarea_depuracion, pdf_executor
+    if tarea_vistas is not None:
+        tarea_vistas.cancel()
+        tarea_vistas = None
+    if tarea_snapshot is not None:
+        tarea_snapshot.cancel()
+        tarea_snapshot = None
+    if tarea_depuracion is not None:
+        tarea_depuracion.cancel()
+        tarea_depuracion = None
+    for tarea in workers_exportacion:
+        tarea.cancel()
+    workers_exportacion.clear()
+    if pdf_executor is not None:
+        pdf_executor.shutdown(wait=False, cancel_futures=True)
+        pdf_executor = None
     if pool is not None:
         await pool.close()
         pool = None
 
+def en_segundo_plano(coro):
+    """Lanza coro como tarea y guarda la referencia hasta que termine: el event loop solo guarda referencias débiles."""
+    tarea = asyncio.create_task(coro)
+    tareas_fondo.add(tarea)
+    tarea.add_done_callback(tareas_fondo.discard)
+
 async def get_db_pool() -> asyncpg.Pool:
     global pool
     if pool is None:
@@ -45,245 +126,906 @@ async def get_db_pool() -> asyncpg.Pool:
         pool = await asyncpg.create_pool(DATABASE_URL, min_size=1, max_size=5)
     return pool
 
+def get_pdf_executor() -> ProcessPoolExecutor:
+    global pdf_executor
+    if pdf_executor is None:
+        # spawn: los procesos hijos no heredan el event loop ni las conexiones
+        pdf_executor = ProcessPoolExecutor(max_workers=PDF_PROCESOS, mp_context=multiprocessing.get_context("spawn"))
+    return pdf_executor
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "service": "reportes"}
 
-@app.get("/dashboard")
-async def get_dashboard():
+# ==================== CACHE POR VERSIÓN DE DATOS ====================
+# Cada resultado se guarda con la versión de las tablas que lee y se sirve
+# desde memoria mientras esa versión no cambie. La versión sale de las
+# estadísticas de PostgreSQL (filas insertadas, actualizadas y borradas),
+# así que no agrega escrituras ni bloqueos a quien modifica los datos.
+# Los contadores no son transaccionales: cada conexión los publica al quedar
+# inactiva, pero si publicó hace menos de 1 s espera hasta 10 s
+# (PGSTAT_IDLE_INTERVAL en PostgreSQL 15+), y hasta 60 s si hay contención
+# de locks. En ese lapso se puede servir el resultado anterior. relfilenode
+# cambia con TRUNCATE y el arranque del servidor cubre el reinicio de los
+# contadores.
+MAX_CACHE_RESULTADOS = 256
+
+cache_resultados: "OrderedDict[str, tuple[str, object]]" = OrderedDict()
+estadisticas_cache: dict[str, dict] = {}
+
+VERSION_TABLAS = """
+    SELECT s.relname AS tabla,
+           extract(epoch FROM pg_postmaster_start_time())::bigint
+               || '.' || c.relfilenode
+               || '.' || (s.n_tup_ins + s.n_tup_upd + s.n_tup_del) AS version
+    FROM pg_stat_user_tables s
+    JOIN pg_class c ON c.oid = s.relid
+    WHERE s.schemaname = 'public' AND s.relname = ANY($1::text[])
+"""
+
+async def versiones_datos(conn, tablas) -> dict[str, str]:
+    return dict(await conn.fetch(VERSION_TABLAS, list(tablas)))
+
+async def version_datos(conn, tablas) -> str:
+    versiones = await versiones_datos(conn, tablas)
+    return ",".join(f"{tabla}:{versiones.get(tabla)}" for tabla in sorted(tablas))
+
+def contar_acceso(endpoint: str, acierto: bool):
+    contador = estadisticas_cache.setdefault(endpoint, {"aciertos": 0, "fallos": 0})
+    contador["aciertos" if acierto else "fallos"] += 1
+
+async def con_cache(endpoint: str, clave: str, tablas, calcular):
+    """
+    Devuelve el resultado cacheado para clave si la versión de tablas no
+    cambió; si no, lo calcula con calcular(conn) y lo guarda.
+    """
     pool = await get_db_pool()
-    
     async with pool.acquire() as conn:
-        total_equipos = await conn.fetchval("SELECT COUNT(*) FROM equipos")
-        
-        equipos_operativos = await conn.fetchval(
-            "SELECT COUNT(*) FROM equipos WHERE estado_operativo = 'operativo'"
-        )
-        
-        equipos_reparacion = await conn.fetchval(
-            "SELECT COUNT(*) FROM equipos WHERE estado_operativo = 'en_reparacion'"
-        )
-        
-        valor_inventario = await conn.fetchval(
-            "SELECT COALESCE(SUM(costo_compra), 0) FROM equipos"
-        )
-        
-        mantenimientos_mes = await conn.fetchval("""
-            SELECT COUNT(*) FROM mantenimientos
-            WHERE EXTRACT(MONTH FROM COALESCE(fecha_realizada, fecha_programada, fecha_registro)) = EXTRACT(MONTH FROM CURRENT_DATE)
-              AND EXTRACT(YEAR FROM COALESCE(fecha_realizada, fecha_programada, fecha_registro)) = EXTRACT(YEAR FROM CURRENT_DATE)
-        """)
-        
-        costo_mantenimiento_mes = await conn.fetchval("""
-            SELECT COALESCE(SUM(costo), 0) FROM mantenimientos
-            WHERE EXTRACT(MONTH FROM COALESCE(fecha_realizada, fecha_programada, fecha_registro)) = EXTRACT(MONTH FROM CURRENT_DATE)
-              AND EXTRACT(YEAR FROM COALESCE(fecha_realizada, fecha_programada, fecha_registro)) = EXTRACT(YEAR FROM CURRENT_DATE)
-        """)
-        
-        return {
+        version = await version_datos(conn, tablas)
+        entrada = cache_resultados.get(clave)
+        if entrada is not None and entrada[0] == version:
+            cache_resultados.move_to_end(clave)
+            contar_acceso(endpoint, True)
+            return entrada[1]
+        resultado = await calcular(conn)
+
+    contar_acceso(endpoint, False)
+    cache_resultados[clave] = (version, resultado)
+    cache_resultados.move_to_end(clave)
+    while len(cache_resultados) > MAX_CACHE_RESULTADOS:
+        cache_resultados.popitem(last=False)
+    return resultado
+
+def ratio_aciertos(aciertos: int, fallos: int):
+    return round(aciertos / (aciertos + fallos), 4) if aciertos + fallos else None
+
+@app.get("/cache/estadisticas")
+async def get_estadisticas_cache():
+    aciertos = sum(c["aciertos"] for c in estadisticas_cache.values())
+    fallos = sum(c["fallos"] for c in estadisticas_cache.values())
+    return {
+        "aciertos": aciertos,
+        "fallos": fallos,
+        "ratio_aciertos": ratio_aciertos(aciertos, fallos),
+        "entradas": len(cache_resultados),
+        "compilacion_query": compilar_consulta.cache_info()._asdict(),
+        "por_endpoint": {
+            endpoint: {**c, "ratio_aciertos": ratio_aciertos(c["aciertos"], c["fallos"])}
+            for endpoint, c in sorted(estadisticas_cache.items())
+        },
+    }
+
+# Un agregado por tabla en una sola sentencia. El mes se filtra como rango
+# sobre la fecha efectiva (idx_mantenimientos_fecha_efectiva) en lugar de
+# EXTRACT(MONTH/YEAR), que obliga a recorrer toda la tabla.
+DASHBOARD_QUERY = """
+    SELECT e.total_equipos, e.equipos_operativos, e.equipos_reparacion, e.valor_inventario,
+           m.mantenimientos_mes, m.costo_mantenimiento_mes
+    FROM (
+        SELECT COUNT(*) AS total_equipos,
+               COUNT(*) FILTER (WHERE estado_operativo = 'operativo') AS equipos_operativos,
+               COUNT(*) FILTER (WHERE estado_operativo = 'en_reparacion') AS equipos_reparacion,
+               COALESCE(SUM(costo_compra), 0) AS valor_inventario
+        FROM equipos
+    ) e
+    CROSS JOIN (
+        SELECT COUNT(*) AS mantenimientos_mes,
+               COALESCE(SUM(costo), 0) AS costo_mantenimiento_mes
+        FROM mantenimientos
+        WHERE COALESCE(fecha_realizada, fecha_programada, fecha_registro) >= date_trunc('month', CURRENT_DATE)::date
+          AND COALESCE(fecha_realizada, fecha_programada, fecha_registro) < (date_trunc('month', CURRENT_DATE) + INTERVAL '1 month')::date
+    ) m
+"""
+
+dashboard_cache = {"datos": None, "calculado_en": 0.0, "version": None}
+dashboard_lock = asyncio.Lock()
+
+async def refrescar_dashboard():
+    # Si otro request ya está recalculando, se espera a ese resultado
+    if dashboard_lock.locked():
+        async with dashboard_lock:
+            return
+    async with dashboard_lock:
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            # El mes en curso es parte de la versión: cambia el filtro de mantenimientos
+            version = f"{date.today():%Y-%m}|" + await version_datos(conn, ("equipos", "mantenimientos"))
+            if version == dashboard_cache["version"]:
+                contar_acceso("dashboard", True)
+                dashboard_cache["calculado_en"] = time.time()
+                return
+            row = await conn.fetchrow(DASHBOARD_QUERY)
+        contar_acceso("dashboard", False)
+        total_equipos = row["total_equipos"]
+        dashboard_cache["datos"] = {
             "total_equipos": total_equipos,
-            "equipos_operativos": equipos_operativos,
-            "equipos_reparacion": equipos_reparacion,
-            "tasa_disponibilidad": round((equipos_operativos / total_equipos * 100) if total_equipos > 0 else 0, 2),
-            "valor_inventario": float(valor_inventario),
-            "mantenimientos_mes": mantenimientos_mes,
-            "costo_mantenimiento_mes": float(costo_mantenimiento_mes)
+            "equipos_operativos": row["equipos_operativos"],
+            "equipos_reparacion": row["equipos_reparacion"],
+            "tasa_disponibilidad": round((row["equipos_operativos"] / total_equipos * 100) if total_equipos > 0 else 0, 2),
+            "valor_inventario": float(row["valor_inventario"]),
+            "mantenimientos_mes": row["mantenimientos_mes"],
+            "costo_mantenimiento_mes": float(row["costo_mantenimiento_mes"])
         }
+        dashboard_cache["calculado_en"] = time.time()
+        dashboard_cache["version"] = version
+
+async def refrescar_dashboard_seguro():
+    """refrescar_dashboard para tareas en segundo plano: registra el error en vez de perderlo."""
+    try:
+        await refrescar_dashboard()
+    except Exception as e:
+        print(f"Error al recalcular el dashboard: {str(e)}")
+
+@app.get("/dashboard")
+async def get_dashboard():
+    """
+    KPIs del tablero. Se sirven desde memoria; pasado DASHBOARD_TTL_SEGUNDOS
+    se devuelve el valor anterior y se recalcula en segundo plano, así que
+    las cargas concurrentes cuestan una sola consulta.
+    """
+    if dashboard_cache["datos"] is None:
+        await refrescar_dashboard_seguro()
+        # Falló este cálculo o el que se esperó
+        if dashboard_cache["datos"] is None:
+            raise HTTPException(status_code=503, detail="Dashboard no disponible, reintente en unos segundos")
+    elif time.time() - dashboard_cache["calculado_en"] > DASHBOARD_TTL_SEGUNDOS and not dashboard_lock.locked():
+        en_segundo_plano(refrescar_dashboard_seguro())
+
+    return {**dashboard_cache["datos"], "calculado_en": dashboard_cache["calculado_en"]}
+
+# ==================== VISTAS MATERIALIZADAS ====================
+# Los reportes de distribución se leen de vistas materializadas (ver
+# schema.sql) en lugar de agrupar toda la tabla equipos en cada request,
+# mientras el snapshot en memoria no esté cargado o SNAPSHOT_FLOTA=0.
+# vista -> consulta sobre la vista con las columnas y el orden del reporte
+VISTAS_REPORTES = {
+    "mv_equipos_por_ubicacion": "SELECT ubicacion, cantidad FROM mv_equipos_por_ubicacion ORDER BY cantidad DESC",
+    "mv_equipos_por_estado": "SELECT estado, cantidad FROM mv_equipos_por_estado ORDER BY cantidad DESC",
+    "mv_equipos_por_categoria": "SELECT categoria, cantidad, valor_total FROM mv_equipos_por_categoria ORDER BY cantidad DESC",
+    "mv_equipos_antiguedad": "SELECT rango_antiguedad, cantidad FROM mv_equipos_antiguedad ORDER BY orden",
+    "mv_equipos_garantia": "SELECT estado_garantia, cantidad FROM mv_equipos_garantia ORDER BY cantidad DESC",
+}
+
+vistas_lock = asyncio.Lock()
+
+async def leer_vista(conn, vista: str):
+    """Filas del reporte junto con el momento del último refresco de la vista."""
+    query = f"""
+        SELECT r.refrescado_en,
+               (SELECT COALESCE(json_agg(t), '[]') FROM ({VISTAS_REPORTES[vista]}) t) AS datos
+        FROM reportes_vistas_refresco r
+        WHERE r.vista = $1
+    """
+    row = await conn.fetchrow(query, vista)
+    if row is None:
+        raise HTTPException(status_code=503, detail=f"Vista {vista} no inicializada")
+    return {"data": json.loads(row["datos"]), "actualizado_en": row["refrescado_en"]}
+
+async def reporte_vista(endpoint: str, vista: str):
+    # Las vistas solo cambian al refrescarse, que actualiza reportes_vistas_refresco
+    resultado = await con_cache(endpoint, endpoint, ("reportes_vistas_refresco",),
+                                lambda conn: leer_vista(conn, vista))
+    return {
+        **resultado,
+        "antiguedad_segundos": round(time.time() - resultado["actualizado_en"].timestamp(), 1),
+    }
+
+async def refrescar_vistas(vistas=None):
+    """Refresca las vistas indicadas (todas por defecto) una por una."""
+    resultado = {}
+    async with vistas_lock:
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            for vista in vistas or VISTAS_REPORTES:
+                t0 = time.perf_counter()
+                refrescado_en = await conn.fetchval("SELECT refrescar_vista_reporte($1)", vista)
+                resultado[vista] = {
+                    "actualizado_en": refrescado_en,
+                    "duracion_ms": round((time.perf_counter() - t0) * 1000, 2),
+                }
+    return resultado
+
+async def ciclo_refresco_vistas():
+    # Al iniciar se refrescan siempre: son el respaldo mientras carga el
+    # snapshot y pueden venir de mucho antes (o vacías desde el init del
+    # schema). Después, con el snapshot cargado nadie las lee: refrescarlas
+    # solo recorrería equipos e invalidaría la cache de reportes.
+    inicio = True
+    while True:
+        if inicio or not snapshot_flota.listo:
+            try:
+                await refrescar_vistas()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error al refrescar vistas de reportes: {str(e)}")
+        inicio = False
+        await asyncio.sleep(VISTAS_REFRESCO_MINUTOS * 60)
+
+@app.post("/vistas/refrescar")
+async def post_refrescar_vistas(vista: Optional[str] = None):
+    if vista is not None and vista not in VISTAS_REPORTES:
+        raise HTTPException(status_code=400, detail=f"vista debe ser uno de: {', '.join(VISTAS_REPORTES)}")
+    return await refrescar_vistas([vista] if vista else None)
 
 @app.get("/equipos-por-ubicacion")
 async def get_equipos_por_ubicacion():
-    pool = await get_db_pool()
-    
-    query = """
-        SELECT u.edificio || ' - ' || u.aula_oficina as ubicacion,
-               COUNT(*) as cantidad
-        FROM equipos e
-        JOIN ubicaciones u ON e.ubicacion_actual_id = u.id
-        GROUP BY u.id, u.edificio, u.aula_oficina
-        ORDER BY cantidad DESC
-    """
-    
-    async with pool.acquire() as conn:
-        rows = await conn.fetch(query)
-        return [dict(row) for row in rows]
+    return await reporte_equipos("equipos-por-ubicacion", "mv_equipos_por_ubicacion", SnapshotFlota.por_ubicacion)
 
 @app.get("/equipos-por-estado")
 async def get_equipos_por_estado():
-    pool = await get_db_pool()
-    
-    query = """
-        SELECT estado_operativo as estado, COUNT(*) as cantidad
-        FROM equipos
-        GROUP BY estado_operativo
-        ORDER BY cantidad DESC
-    """
-    
-    async with pool.acquire() as conn:
-        rows = await conn.fetch(query)
-        return [dict(row) for row in rows]
+    return await reporte_equipos("equipos-por-estado", "mv_equipos_por_estado", SnapshotFlota.por_estado)
 
 @app.get("/equipos-por-categoria")
 async def get_equipos_por_categoria():
-    pool = await get_db_pool()
-    
-    query = """
-        SELECT c.nombre as categoria, COUNT(*) as cantidad,
-               COALESCE(SUM(e.costo_compra), 0) as valor_total
-        FROM equipos e
-        JOIN categorias_equipos c ON e.categoria_id = c.id
-        GROUP BY c.nombre
-        ORDER BY cantidad DESC
-    """
-    
-    async with pool.acquire() as conn:
-        rows = await conn.fetch(query)
-        return [dict(row) for row in rows]
+    return await reporte_equipos("equipos-por-categoria", "mv_equipos_por_categoria", SnapshotFlota.por_categoria)
 
 @app.get("/equipos-antiguedad")
 async def get_equipos_antiguedad():
-    pool = await get_db_pool()
-    
-    query = """
-        SELECT rango_antiguedad, COUNT(*) as cantidad
-        FROM (
-            SELECT 
-                CASE 
-                    WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, fecha_compra)) < 1 THEN 'Menos de 1 año'
-                    WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, fecha_compra)) BETWEEN 1 AND 2 THEN '1-2 años'
-                    WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, fecha_compra)) BETWEEN 3 AND 4 THEN '3-4 años'
-                    WHEN EXTRACT(YEAR FROM AGE(CURRENT_DATE, fecha_compra)) BETWEEN 5 AND 6 THEN '5-6 años'
-                    ELSE 'Más de 6 años'
-                END as rango_antiguedad
-            FROM equipos
-            WHERE fecha_compra IS NOT NULL
-        ) t
-        GROUP BY rango_antiguedad
-        ORDER BY 
-            CASE rango_antiguedad
-                WHEN 'Menos de 1 año' THEN 1
-                WHEN '1-2 años' THEN 2
-                WHEN '3-4 años' THEN 3
-                WHEN '5-6 años' THEN 4
-                ELSE 5
-            END
-    """
-    
-    async with pool.acquire() as conn:
-        rows = await conn.fetch(query)
-        return [dict(row) for row in rows]
+    return await reporte_equipos("equipos-antiguedad", "mv_equipos_antiguedad", SnapshotFlota.antiguedad)
 
-@app.post("/export/excel")
-async def export_excel(report_data: dict):
-    report_type = report_data.get("type", "equipos")
-    pool = await get_db_pool()
+# ==================== SNAPSHOT COLUMNAR DE EQUIPOS ====================
+# Copia en memoria de las columnas de equipos que usan los reportes de
+# distribución, antigüedad, garantía y valor: un array de NumPy por columna,
+# unos 30 bytes por equipo. Los reportes se calculan con bincount y máscaras
+# sin ir a la base. Se carga completa al iniciar y luego cada
+# SNAPSHOT_INTERVALO_SEGUNDOS se releen solo los equipos de equipos_cambios
+# (ver schema.sql). Mientras no está cargada se usan las vistas materializadas.
+FECHA_NULA = np.iinfo(np.int32).min
+SNAPSHOT_LOTE = 50000
+TABLAS_ETIQUETAS = ("categorias_equipos", "ubicaciones")
+RANGOS_ANTIGUEDAD = ("Menos de 1 año", "1-2 años", "3-4 años", "5-6 años", "Más de 6 años")
 
+# Fechas como días desde 1970 y NULL como centinela para que todas las
+# columnas sean numéricas. costo_compra NULL suma 0, como COALESCE(SUM(...), 0)
+COLUMNAS_SNAPSHOT = """
+    SELECT id,
+           COALESCE(categoria_id, -1) AS categoria,
+           COALESCE(ubicacion_actual_id, -1) AS ubicacion,
+           estado_operativo AS estado,
+           COALESCE(fecha_compra - DATE '1970-01-01', -2147483648) AS compra,
+           COALESCE(costo_compra, 0)::float8 AS costo,
+           COALESCE(fecha_garantia_fin - DATE '1970-01-01', -2147483648) AS garantia
+    FROM equipos
+"""
+
+def dias_epoca(fecha: date) -> int:
+    return (fecha - date(1970, 1, 1)).days
+
+def restar_anios(fecha: date, anios: int) -> date:
+    """fecha - INTERVAL 'n years' de PostgreSQL (el 29/02 pasa a 28/02)."""
     try:
-        # Selección de consulta según tipo de reporte
-        if report_type == "equipos":
-            query = """
-                SELECT e.codigo_inventario, e.nombre, e.marca, e.modelo,
-                       c.nombre as categoria, e.estado_operativo as estado,
-                       u.edificio || ' - ' || u.aula_oficina as ubicacion,
-                       e.fecha_compra, e.costo_compra
-                FROM equipos e
-                LEFT JOIN categorias_equipos c ON e.categoria_id = c.id
-                LEFT JOIN ubicaciones u ON e.ubicacion_actual_id = u.id
-                ORDER BY e.codigo_inventario
-            """
-        elif report_type == "mantenimientos":
-            query = """
-                SELECT m.id, m.tipo, m.fecha_programada, m.fecha_realizada,
-                       e.codigo_inventario, e.nombre as equipo,
-                       m.estado, m.costo, m.descripcion
-                FROM mantenimientos m
-                JOIN equipos e ON m.equipo_id = e.id
-                ORDER BY m.fecha_programada DESC
-            """
-        elif report_type == "proveedores":
-            query = """
-                SELECT id, razon_social, ruc, telefono, email, activo
-                FROM proveedores
-                ORDER BY razon_social
+        return fecha.replace(year=fecha.year - anios)
+    except ValueError:
+        return fecha.replace(year=fecha.year - anios, day=28)
+
+def ordenar_por_cantidad(filas: list, clave: str) -> list:
+    return sorted(filas, key=lambda f: (-f["cantidad"], str(f[clave])))
+
+class SnapshotFlota:
+    """Columnas de equipos ordenadas por id, más los nombres para las etiquetas."""
+
+    def __init__(self):
+        self.columnas: dict[str, np.ndarray] | None = None
+        self.estados: list = []
+        self.codigos_estado: dict = {}
+        self.categorias: dict[int, str] = {}
+        self.ubicaciones: dict[int, str] = {}
+        self.versiones: dict[str, str] = {}
+        # xmin (xid8 como texto) de la última lectura: los cambios con
+        # txid >= xmin pueden no haber estado visibles todavía
+        self.xmin: str | None = None
+        self.sincronizado_en = 0.0
+        # (reporte, fecha) -> filas; se vacía cuando cambian los datos
+        self.resultados: dict = {}
+        self.cargas_completas = 0
+        self.equipos_actualizados = 0
+
+    @property
+    def listo(self) -> bool:
+        return self.columnas is not None
+
+    def codigo_estado(self, estado) -> int:
+        codigo = self.codigos_estado.get(estado)
+        if codigo is None:
+            codigo = self.codigos_estado[estado] = len(self.estados)
+            self.estados.append(estado)
+        return codigo
+
+    def codificar(self, rows) -> dict[str, np.ndarray]:
+        n = len(rows)
+        ids, categorias, ubicaciones, estados, compras, costos, garantias = zip(*rows) if rows else ((),) * 7
+        return {
+            "id": np.fromiter(ids, np.int32, n),
+            "categoria": np.fromiter(categorias, np.int32, n),
+            "ubicacion": np.fromiter(ubicaciones, np.int32, n),
+            "estado": np.fromiter(map(self.codigo_estado, estados), np.int16, n),
+            "compra": np.fromiter(compras, np.int32, n),
+            "costo": np.fromiter(costos, np.float64, n),
+            "garantia": np.fromiter(garantias, np.int32, n),
+        }
+
+    @staticmethod
+    def ordenar(columnas: dict) -> dict:
+        ids = columnas["id"]
+        if len(ids) > 1 and not np.all(ids[1:] > ids[:-1]):
+            orden = np.argsort(ids, kind="stable")
+            columnas = {nombre: columna[orden] for nombre, columna in columnas.items()}
+        return columnas
+
+    def reemplazar(self, columnas: dict):
+        self.columnas = self.ordenar(columnas)
+
+    def aplicar_cambios(self, cambiados: np.ndarray, nuevas: dict):
+        """
+        cambiados: ids de equipos_cambios; nuevas: sus filas actuales. Los que
+        ya estaban se pisan en su lugar, los que no aparecen en nuevas se
+        borran y el resto se agrega.
+        """
+        ids = self.columnas["id"]
+        pos = np.searchsorted(ids, nuevas["id"])
+        existe = pos < len(ids)
+        existe[existe] = ids[pos[existe]] == nuevas["id"][existe]
+        for nombre, columna in self.columnas.items():
+            columna[pos[existe]] = nuevas[nombre][existe]
+
+        borrados = np.setdiff1d(cambiados, nuevas["id"])
+        conservar = np.isin(ids, borrados, invert=True) if len(borrados) else slice(None)
+        altas = ~existe
+        if len(borrados) or altas.any():
+            self.columnas = self.ordenar({
+                nombre: np.concatenate([columna[conservar], nuevas[nombre][altas]])
+                for nombre, columna in self.columnas.items()
+            })
+
+    @property
+    def memoria_bytes(self) -> int:
+        return sum(columna.nbytes for columna in self.columnas.values()) if self.listo else 0
+
+    def por_ubicacion(self) -> list:
+        # +1 para que el -1 de "sin ubicación" caiga en la posición 0
+        conteos = np.bincount(self.columnas["ubicacion"] + 1)
+        return ordenar_por_cantidad([
+            {"ubicacion": nombre, "cantidad": int(conteos[i + 1])}
+            for i, nombre in self.ubicaciones.items()
+            if i + 1 < len(conteos) and conteos[i + 1]
+        ], "ubicacion")
+
+    def por_estado(self) -> list:
+        conteos = np.bincount(self.columnas["estado"], minlength=len(self.estados))
+        return ordenar_por_cantidad([
+            {"estado": estado, "cantidad": int(conteos[codigo])}
+            for codigo, estado in enumerate(self.estados)
+            if conteos[codigo]
+        ], "estado")
+
+    def por_categoria(self) -> list:
+        categorias = self.columnas["categoria"] + 1
+        conteos = np.bincount(categorias)
+        valores = np.bincount(categorias, weights=self.columnas["costo"])
+        return ordenar_por_cantidad([
+            {"categoria": nombre, "cantidad": int(conteos[i + 1]), "valor_total": round(float(valores[i + 1]), 2)}
+            for i, nombre in self.categorias.items()
+            if i + 1 < len(conteos) and conteos[i + 1]
+        ], "categoria")
+
+    def antiguedad(self, hoy: date | None = None) -> list:
+        hoy = hoy or date.today()
+        compras = self.columnas["compra"]
+        # Un equipo tiene al menos n años si se compró en o antes de hoy - n
+        # años. FECHA_NULA cumple todos los cortes; la vista descarta los NULL
+        nulos = np.count_nonzero(compras == FECHA_NULA)
+        al_menos = [len(compras)] + [
+            np.count_nonzero(compras <= dias_epoca(restar_anios(hoy, anios))) for anios in (1, 3, 5, 7)
+        ] + [nulos]
+        return [
+            {"rango_antiguedad": rango, "cantidad": int(al_menos[i] - al_menos[i + 1])}
+            for i, rango in enumerate(RANGOS_ANTIGUEDAD)
+            if al_menos[i] - al_menos[i + 1]
+        ]
+
+    def garantia(self, hoy: date | None = None) -> list:
+        garantias = self.columnas["garantia"]
+        sin_informacion = np.count_nonzero(garantias == FECHA_NULA)
+        en_garantia = np.count_nonzero(garantias >= dias_epoca(hoy or date.today()))
+        return ordenar_por_cantidad([
+            {"estado_garantia": estado, "cantidad": int(cantidad)}
+            for estado, cantidad in (
+                ("En garantía", en_garantia),
+                ("Fuera de garantía", len(garantias) - en_garantia - sin_informacion),
+                ("Sin información", sin_informacion),
+            )
+            if cantidad
+        ], "estado_garantia")
+
+snapshot_flota = SnapshotFlota()
+
+async def leer_columnas(conn, snapshot: SnapshotFlota, ids: np.ndarray | None = None) -> dict:
+    """Lee de equipos (todos o solo ids) por lotes y devuelve las columnas codificadas."""
+    if ids is None:
+        stmt = await conn.prepare(COLUMNAS_SNAPSHOT)
+        cursor = await stmt.cursor()
+    else:
+        stmt = await conn.prepare(COLUMNAS_SNAPSHOT + " WHERE id = ANY($1::int[])")
+        cursor = await stmt.cursor(ids.tolist())
+    lotes = []
+    while rows := await cursor.fetch(SNAPSHOT_LOTE):
+        lotes.append(snapshot.codificar(rows))
+    if not lotes:
+        return snapshot.codificar([])
+    return {nombre: np.concatenate([lote[nombre] for lote in lotes]) for nombre in lotes[0]}
+
+async def sincronizar_snapshot(conn, snapshot: SnapshotFlota):
+    """
+    Pone el snapshot al día dentro de la transacción en curso de conn.
+    Recarga todo la primera vez, después de un TRUNCATE o si pasó más de la
+    mitad de la retención del feed sin sincronizar; si no, relee solo los
+    equipos con cambios desde la lectura anterior.
+    """
+    xmin = await conn.fetchval("SELECT pg_snapshot_xmin(pg_current_snapshot())::text")
+    # Las etiquetas admiten la demora de las estadísticas; los equipos no, por
+    # eso el feed se consulta siempre (es un rango de idx_equipos_cambios_txid)
+    versiones = await versiones_datos(conn, TABLAS_ETIQUETAS)
+
+    cambiados = None
+    recargar = snapshot.xmin is None or time.time() - snapshot.sincronizado_en > CAMBIOS_RETENCION_HORAS * 1800
+    if not recargar:
+        cambios = await conn.fetchrow(
             """
+            SELECT bool_or(equipo_id IS NULL) AS recargar,
+                   array_agg(DISTINCT equipo_id) FILTER (WHERE equipo_id IS NOT NULL) AS ids
+            FROM equipos_cambios
+            WHERE txid >= $1::text::xid8
+            """,
+            snapshot.xmin
+        )
+        recargar = bool(cambios["recargar"])
+        if not recargar and cambios["ids"]:
+            cambiados = np.array(cambios["ids"], dtype=np.int32)
+            snapshot.aplicar_cambios(cambiados, await leer_columnas(conn, snapshot, cambiados))
+            snapshot.equipos_actualizados += len(cambiados)
+    if recargar:
+        snapshot.reemplazar(await leer_columnas(conn, snapshot))
+        snapshot.cargas_completas += 1
+
+    if recargar or versiones.get("categorias_equipos") != snapshot.versiones.get("categorias_equipos"):
+        snapshot.categorias = dict(await conn.fetch("SELECT id, nombre FROM categorias_equipos"))
+    if recargar or versiones.get("ubicaciones") != snapshot.versiones.get("ubicaciones"):
+        snapshot.ubicaciones = dict(await conn.fetch(
+            "SELECT id, edificio || ' - ' || aula_oficina FROM ubicaciones"
+        ))
+    if recargar or cambiados is not None or versiones != snapshot.versiones:
+        snapshot.resultados.clear()
+    snapshot.versiones = versiones
+    snapshot.xmin = xmin
+    snapshot.sincronizado_en = time.time()
+
+async def ciclo_snapshot():
+    while True:
+        try:
+            pool = await get_db_pool()
+            async with pool.acquire() as conn:
+                # Una sola foto de la base para versiones, feed y filas
+                async with conn.transaction(isolation="repeatable_read", readonly=True):
+                    await sincronizar_snapshot(conn, snapshot_flota)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error al sincronizar el snapshot de equipos: {str(e)}")
+        await asyncio.sleep(SNAPSHOT_INTERVALO_SEGUNDOS)
+
+async def ciclo_depuracion_cambios():
+    """Borra cada hora las entradas de equipos_cambios más viejas que CAMBIOS_RETENCION_HORAS."""
+    while True:
+        try:
+            pool = await get_db_pool()
+            async with pool.acquire() as conn:
+                await conn.execute(
+                    "DELETE FROM equipos_cambios WHERE registrado_en < NOW() - $1 * INTERVAL '1 hour'",
+                    CAMBIOS_RETENCION_HORAS
+                )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error al depurar equipos_cambios: {str(e)}")
+        await asyncio.sleep(3600)
+
+async def reporte_equipos(endpoint: str, vista: str, calcular):
+    """Reporte desde el snapshot si está cargado; si no, desde la vista materializada."""
+    if not snapshot_flota.listo:
+        return {**await reporte_vista(endpoint, vista), "fuente": "vista"}
+    # Antigüedad y garantía dependen de la fecha además de los datos
+    clave = (endpoint, date.today())
+    datos = snapshot_flota.resultados.get(clave)
+    if datos is None:
+        datos = snapshot_flota.resultados[clave] = calcular(snapshot_flota)
+    return {
+        "data": datos,
+        "actualizado_en": datetime.fromtimestamp(snapshot_flota.sincronizado_en, timezone.utc),
+        "antiguedad_segundos": round(time.time() - snapshot_flota.sincronizado_en, 1),
+        "fuente": "snapshot",
+    }
+
+@app.get("/snapshot/estado")
+async def get_estado_snapshot():
+    return {
+        "activo": SNAPSHOT_FLOTA,
+        "listo": snapshot_flota.listo,
+        "equipos": len(snapshot_flota.columnas["id"]) if snapshot_flota.listo else 0,
+        "memoria_mb": round(snapshot_flota.memoria_bytes / 1e6, 2),
+        "actualizado_en": datetime.fromtimestamp(snapshot_flota.sincronizado_en, timezone.utc) if snapshot_flota.listo else None,
+        "cargas_completas": snapshot_flota.cargas_completas,
+        "equipos_actualizados": snapshot_flota.equipos_actualizados,
+    }
+
+# ==================== CONSULTA GENÉRICA ====================
+# POST /query agrupa equipos por dimensiones y calcula medidas de una lista
+# cerrada. Solo se interpolan expresiones de estas tablas; los valores de
+# filtro van siempre como parámetros.
+# dimensión -> (expresión SQL, join que necesita)
+DIMENSIONES = {
+    "categoria": ("c.nombre", "categoria"),
+    "ubicacion": ("u.edificio || ' - ' || u.aula_oficina", "ubicacion"),
+    "edificio": ("u.edificio", "ubicacion"),
+    "estado": ("e.estado_operativo", None),
+    "proveedor": ("p.razon_social", "proveedor"),
+    "mes_compra": ("date_trunc('month', e.fecha_compra)::date", None),
+}
+
+MEDIDAS = {
+    "cantidad": "COUNT(*)",
+    "costo_total": "COALESCE(SUM(e.costo_compra), 0)",
+    "antiguedad_promedio": "ROUND(AVG(CURRENT_DATE - e.fecha_compra) / 365.25, 2)",
+}
+
+JOINS_CONSULTA = {
+    "categoria": "LEFT JOIN categorias_equipos c ON e.categoria_id = c.id",
+    "ubicacion": "LEFT JOIN ubicaciones u ON e.ubicacion_actual_id = u.id",
+    "proveedor": "LEFT JOIN proveedores p ON e.proveedor_id = p.id",
+}
+
+# Filtros por valor sobre las dimensiones de texto
+FILTROS_CONSULTA = ("categoria", "ubicacion", "edificio", "estado", "proveedor")
+
+MAX_FILAS_CONSULTA = 10000
+
+class ConsultaReporte(BaseModel):
+    dimensiones: list[str] = []
+    medidas: list[str] = ["cantidad"]
+    filtros: dict[str, list[str]] = {}
+    fecha_compra_desde: Optional[date] = None
+    fecha_compra_hasta: Optional[date] = None
+    orden: Optional[str] = None
+    descendente: bool = False
+    limite: int = 1000
+
+@lru_cache(maxsize=256)
+def compilar_consulta(dimensiones: tuple, medidas: tuple, filtros: tuple,
+                      desde: bool, hasta: bool, orden: str, descendente: bool) -> str:
+    """
+    Arma el SELECT ... GROUP BY para una forma de consulta. El texto es
+    estable para la misma forma, así que también se reutiliza el statement
+    preparado (y su plan) en la conexión de asyncpg.
+    """
+    joins = {DIMENSIONES[d][1] for d in dimensiones + filtros} - {None}
+    columnas = [f"{DIMENSIONES[d][0]} AS {d}" for d in dimensiones]
+    columnas += [f"{MEDIDAS[m]} AS {m}" for m in medidas]
+
+    condiciones = []
+    for i, f in enumerate(filtros, start=1):
+        condiciones.append(f"{DIMENSIONES[f][0]} = ANY(${i}::text[])")
+    n = len(filtros)
+    if desde:
+        n += 1
+        condiciones.append(f"e.fecha_compra >= ${n}")
+    if hasta:
+        n += 1
+        condiciones.append(f"e.fecha_compra <= ${n}")
+
+    sql = f"SELECT {', '.join(columnas)} FROM equipos e"
+    for join in sorted(joins):
+        sql += f" {JOINS_CONSULTA[join]}"
+    if condiciones:
+        sql += " WHERE " + " AND ".join(condiciones)
+    if dimensiones:
+        sql += " GROUP BY " + ", ".join(str(i) for i in range(1, len(dimensiones) + 1))
+    # El resto de las dimensiones desempata para que el orden sea estable
+    terminos = [f"{orden} {'DESC' if descendente else 'ASC'} NULLS LAST"]
+    terminos += [d for d in dimensiones if d != orden]
+    sql += " ORDER BY " + ", ".join(terminos)
+    sql += f" LIMIT ${n + 1}"
+    return sql
+
+@app.post("/query")
+async def consulta_reporte(consulta: ConsultaReporte):
+    """
+    Agregados de equipos por cualquier combinación de dimensiones, en una
+    sola consulta. Ejemplo:
+    {"dimensiones": ["categoria", "estado"], "medidas": ["cantidad", "costo_total"],
+     "filtros": {"edificio": ["A"]}}
+    """
+    invalidas = [d for d in consulta.dimensiones if d not in DIMENSIONES]
+    if invalidas or len(set(consulta.dimensiones)) != len(consulta.dimensiones):
+        raise HTTPException(status_code=400, detail=f"dimensiones válidas (sin repetir): {', '.join(DIMENSIONES)}")
+    if not consulta.medidas or any(m not in MEDIDAS for m in consulta.medidas) \
+            or len(set(consulta.medidas)) != len(consulta.medidas):
+        raise HTTPException(status_code=400, detail=f"medidas válidas (sin repetir): {', '.join(MEDIDAS)}")
+    if any(f not in FILTROS_CONSULTA for f in consulta.filtros):
+        raise HTTPException(status_code=400, detail=f"filtros válidos: {', '.join(FILTROS_CONSULTA)}")
+    orden = consulta.orden or (consulta.dimensiones[0] if consulta.dimensiones else consulta.medidas[0])
+    if orden not in consulta.dimensiones and orden not in consulta.medidas:
+        raise HTTPException(status_code=400, detail="orden debe ser una de las dimensiones o medidas pedidas")
+    if not 1 <= consulta.limite <= MAX_FILAS_CONSULTA:
+        raise HTTPException(status_code=400, detail=f"limite debe estar entre 1 y {MAX_FILAS_CONSULTA}")
+
+    filtros = tuple(sorted(consulta.filtros))
+    sql = compilar_consulta(
+        tuple(consulta.dimensiones), tuple(consulta.medidas), filtros,
+        consulta.fecha_compra_desde is not None, consulta.fecha_compra_hasta is not None,
+        orden, consulta.descendente,
+    )
+    params = [consulta.filtros[f] for f in filtros]
+    params += [f for f in (consulta.fecha_compra_desde, consulta.fecha_compra_hasta) if f is not None]
+    params.append(consulta.limite)
+
+    async def calcular(conn):
+        rows = await conn.fetch(sql, *params)
+        return [dict(row) for row in rows]
+
+    clave = "query:" + json.dumps(consulta.dict(), sort_keys=True, default=str)
+    # La antigüedad depende de la fecha además de los datos
+    if "antiguedad_promedio" in consulta.medidas:
+        clave += f"|{date.today()}"
+    filas = await con_cache("query", clave, ("equipos", "categorias_equipos", "ubicaciones", "proveedores"), calcular)
+    return {"dimensiones": consulta.dimensiones, "medidas": consulta.medidas, "filas": filas}
+
+@app.get("/query/opciones")
+async def opciones_consulta():
+    return {"dimensiones": list(DIMENSIONES), "medidas": list(MEDIDAS), "filtros": list(FILTROS_CONSULTA)}
+
+# ==================== EXPORTACIÓN ====================
+# Consultas de exportación por tipo de reporte
+CONSULTAS_EXPORTACION = {
+    "equipos": """
+        SELECT e.codigo_inventario, e.nombre, e.marca, e.modelo,
+               c.nombre as categoria, e.estado_operativo as estado,
+               u.edificio || ' - ' || u.aula_oficina as ubicacion,
+               e.fecha_compra, e.costo_compra
+        FROM equipos e
+        LEFT JOIN categorias_equipos c ON e.categoria_id = c.id
+        LEFT JOIN ubicaciones u ON e.ubicacion_actual_id = u.id
+        ORDER BY e.codigo_inventario
+    """,
+    "mantenimientos": """
+        SELECT m.id, m.tipo, m.fecha_programada, m.fecha_realizada,
+               e.codigo_inventario, e.nombre as equipo,
+               m.estado, m.costo, m.descripcion
+        FROM mantenimientos m
+        JOIN equipos e ON m.equipo_id = e.id
+        ORDER BY m.fecha_programada DESC
+    """,
+    "proveedores": """
+        SELECT id, razon_social, ruc, telefono, email, activo
+        FROM proveedores
+        ORDER BY razon_social
+    """,
+}
+
+MEDIA_TYPE_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+def escribir_filas_excel(worksheet, fila_inicial: int, rows) -> int:
+    for offset, row in enumerate(rows):
+        worksheet.write_row(fila_inicial + offset, 0, tuple(row.values()))
+    return fila_inicial + len(rows)
+
+async def escribir_excel(conn, report_type: str, path: str) -> int:
+    """
+    Escribe el reporte en path leyendo la consulta con un cursor por lotes.
+    XlsxWriter en modo constant_memory vuelca cada fila a disco al pasar a
+    la siguiente, así que la memoria no depende del tamaño del reporte. La
+    escritura corre en un hilo para no bloquear el event loop. Devuelve la
+    cantidad de filas de datos.
+    """
+    workbook = xlsxwriter.Workbook(path, {
+        "constant_memory": True,
+        "default_date_format": "yyyy-mm-dd",
+    })
+    worksheet = workbook.add_worksheet(report_type.capitalize())
+    header_format = workbook.add_format({"bold": True})
+
+    fila = 1
+    async with conn.transaction():
+        cursor = await conn.cursor(CONSULTAS_EXPORTACION[report_type])
+        rows = await cursor.fetch(EXPORT_MUESTRA_ANCHOS)
+        if rows:
+            # Ancho de columnas estimado con una muestra de filas
+            columnas = list(rows[0].keys())
+            for idx, col in enumerate(columnas):
+                max_length = max(len(col), *(len(str(r[idx])) for r in rows)) + 2
+                worksheet.set_column(idx, idx, min(max_length, 50))
+            worksheet.write_row(0, 0, columnas, header_format)
+
+        while rows:
+            fila = await asyncio.to_thread(escribir_filas_excel, worksheet, fila, rows)
+            rows = await cursor.fetch(EXPORT_LOTE)
+
+    await asyncio.to_thread(workbook.close)
+    return fila - 1
+
+# Formatos columnares y CSV: se escriben por lotes desde el cursor, con el
+# esquema tomado de los tipos de la consulta preparada
+TIPOS_ARROW = {
+    "int2": pa.int16(),
+    "int4": pa.int32(),
+    "int8": pa.int64(),
+    "float4": pa.float32(),
+    "float8": pa.float64(),
+    "numeric": pa.float64(),
+    "bool": pa.bool_(),
+    "date": pa.date32(),
+    "timestamp": pa.timestamp("us"),
+    "timestamptz": pa.timestamp("us", tz="UTC"),
+    "varchar": pa.string(),
+    "text": pa.string(),
+    "bpchar": pa.string(),
+}
+
+class EscritorCsvGz:
+    def __init__(self, path: str):
+        self.path = path
+
+    def abrir(self, columnas, tipos):
+        self.archivo = gzip.open(self.path, "wt", newline="", encoding="utf-8", compresslevel=6)
+        self.writer = csv.writer(self.archivo)
+        self.writer.writerow(columnas)
+
+    def escribir(self, rows):
+        self.writer.writerows(rows)
+
+    def cerrar(self):
+        self.archivo.close()
+
+class EscritorArrow:
+    """Parquet o Arrow IPC (archivo), un record batch por lote del cursor."""
+
+    def __init__(self, path: str, formato: str):
+        self.path = path
+        self.formato = formato
+
+    def abrir(self, columnas, tipos):
+        self.schema = pa.schema([(c, TIPOS_ARROW.get(t, pa.string())) for c, t in zip(columnas, tipos)])
+        # numeric llega como Decimal y los tipos sin mapear se exportan como texto
+        self.conversiones = [
+            float if t == "numeric" else (str if t not in TIPOS_ARROW else None)
+            for t in tipos
+        ]
+        if self.formato == "parquet":
+            self.writer = pq.ParquetWriter(self.path, self.schema, compression="zstd")
         else:
-            raise HTTPException(status_code=400, detail="Tipo de reporte no válido")
+            self.writer = pa.ipc.new_file(self.path, self.schema,
+                                          options=pa.ipc.IpcWriteOptions(compression="zstd"))
+
+    def escribir(self, rows):
+        arrays = []
+        for valores, campo, conversion in zip(zip(*rows), self.schema, self.conversiones):
+            if conversion is not None:
+                valores = [conversion(v) if v is not None else None for v in valores]
+            arrays.append(pa.array(valores, type=campo.type))
+        self.writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+
+    def cerrar(self):
+        self.writer.close()
 
-        # Ejecutar consulta
+async def escribir_por_lotes(conn, report_type: str, escritor) -> int:
+    """Vuelca la consulta del reporte en el escritor, EXPORT_LOTE filas por vez."""
+    filas = 0
+    async with conn.transaction():
+        stmt = await conn.prepare(CONSULTAS_EXPORTACION[report_type])
+        atributos = stmt.get_attributes()
+        escritor.abrir([a.name for a in atributos], [a.type.name for a in atributos])
+        try:
+            cursor = await stmt.cursor()
+            while rows := await cursor.fetch(EXPORT_LOTE):
+                await asyncio.to_thread(escritor.escribir, rows)
+                filas += len(rows)
+        finally:
+            await asyncio.to_thread(escritor.cerrar)
+    return filas
+
+# formato -> (extensión, media type)
+FORMATOS_ARCHIVO = {
+    "xlsx": ("xlsx", MEDIA_TYPE_XLSX),
+    "csv": ("csv.gz", "application/gzip"),
+    "parquet": ("parquet", "application/vnd.apache.parquet"),
+    "arrow": ("arrow", "application/vnd.apache.arrow.file"),
+}
+
+async def escribir_archivo(conn, report_type: str, formato: str, path: str) -> int:
+    if formato == "xlsx":
+        return await escribir_excel(conn, report_type, path)
+    if formato == "csv":
+        return await escribir_por_lotes(conn, report_type, EscritorCsvGz(path))
+    return await escribir_por_lotes(conn, report_type, EscritorArrow(path, formato))
+
+async def exportar_archivo(report_type: str, formato: str):
+    if report_type not in CONSULTAS_EXPORTACION:
+        raise HTTPException(status_code=400, detail="Tipo de reporte no válido")
+    extension, media_type = FORMATOS_ARCHIVO[formato]
+
+    pool = await get_db_pool()
+    fd, path = tempfile.mkstemp(prefix=f"{report_type}_", suffix=f".{extension}")
+    os.close(fd)
+
+    try:
         async with pool.acquire() as conn:
-            rows = await conn.fetch(query)
-            
-            # Convertir a lista de diccionarios
-            data = [dict(row) for row in rows]
-            
-            # Verificar que hay datos
-            if not data:
-                raise HTTPException(status_code=404, detail="No hay datos para exportar")
-            
-            # Crear DataFrame
-            df = pd.DataFrame(data)
-
-        # Crear el archivo Excel en memoria
-        output = io.BytesIO()
-        
-        # Usar XlsxWriter como engine
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, index=False, sheet_name=report_type.capitalize())
-            
-            # Obtener el workbook y worksheet para formato adicional (opcional)
-            workbook = writer.book
-            worksheet = writer.sheets[report_type.capitalize()]
-            
-            # Ajustar ancho de columnas automáticamente
-            for idx, col in enumerate(df.columns):
-                max_length = max(
-                    df[col].astype(str).apply(len).max(),
-                    len(str(col))
-                ) + 2
-                worksheet.set_column(idx, idx, min(max_length, 50))
-        
-        # CRÍTICO: Volver al inicio del buffer
-        output.seek(0)
-        
-        # Obtener el contenido completo
-        excel_bytes = output.read()
-        
-        # Verificar que el archivo tiene contenido
-        if len(excel_bytes) == 0:
-            raise HTTPException(status_code=500, detail="El archivo Excel generado está vacío")
-        
-        # Cerrar el buffer original
-        output.close()
-        
-        # Crear un nuevo buffer con el contenido para la respuesta
-        response_buffer = io.BytesIO(excel_bytes)
-        
-        # Preparar nombre del archivo
+            filas = await escribir_archivo(conn, report_type, formato, path)
+
+        if filas == 0:
+            raise HTTPException(status_code=404, detail="No hay datos para exportar")
+
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"{report_type}_{timestamp}.xlsx"
+        filename = f"{report_type}_{timestamp}.{extension}"
 
-        # Retornar como StreamingResponse con headers correctos
-        return StreamingResponse(
-            response_buffer,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={
-                "Content-Disposition": f'attachment; filename="{filename}"',
-                "Content-Type": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                "Content-Length": str(len(excel_bytes)),
-                "Cache-Control": "no-cache"
-            }
+        # Se envía desde el archivo temporal por bloques y se borra al terminar
+        return FileResponse(
+            path,
+            media_type=media_type,
+            filename=filename,
+            headers={"Cache-Control": "no-cache"},
+            background=BackgroundTask(os.remove, path),
         )
 
     except HTTPException:
+        os.remove(path)
         raise
     except Exception as e:
+        os.remove(path)
         import traceback
-        print(f"Error al exportar Excel: {str(e)}")
+        print(f"Error al exportar {formato}: {str(e)}")
         print(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Error al exportar: {str(e)}")
 
+@app.post("/export/excel")
+async def export_excel(report_data: dict):
+    return await exportar_archivo(report_data.get("type", "equipos"), "xlsx")
+
+@app.post("/export/csv")
+async def export_csv(report_data: dict):
+    """CSV comprimido con gzip."""
+    return await exportar_archivo(report_data.get("type", "equipos"), "csv")
+
+@app.post("/export/parquet")
+async def export_parquet(report_data: dict):
+    return await exportar_archivo(report_data.get("type", "equipos"), "parquet")
+
+@app.post("/export/arrow")
+async def export_arrow(report_data: dict):
+    """Arrow IPC en formato archivo (pyarrow.ipc.open_file / pandas.read_feather)."""
+    return await exportar_archivo(report_data.get("type", "equipos"), "arrow")
+
 @app.get("/export/file")
 async def download_export(filename: str):
-    base_dir = Path("/app/reportes").resolve()
+    base_dir = REPORTS_PATH.resolve()
     safe_name = Path(filename).name
     target = (base_dir / safe_name).resolve()
     if base_dir not in target.parents and target != base_dir:
@@ -291,14 +1033,12 @@ async def download_export(filename: str):
     if not target.exists() or not target.is_file():
         raise HTTPException(status_code=404, detail="Archivo no encontrado")
     media_type = "application/pdf" if target.suffix.lower() == ".pdf" else (
-        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet" if target.suffix.lower() == ".xlsx" else "application/octet-stream"
+        MEDIA_TYPE_XLSX if target.suffix.lower() == ".xlsx" else "application/octet-stream"
     )
     return FileResponse(path=str(target), media_type=media_type, filename=target.name)
 
 @app.get("/costos-mantenimiento")
 async def get_costos_mantenimiento(year: Optional[int] = None):
-    pool = await get_db_pool()
-    
     if not year:
         year = datetime.now().year
     
@@ -316,14 +1056,14 @@ async def get_costos_mantenimiento(year: Optional[int] = None):
         ORDER BY mes_num, tipo
     """
     
-    async with pool.acquire() as conn:
+    async def calcular(conn):
         rows = await conn.fetch(query, year)
         return [dict(row) for row in rows]
 
+    return await con_cache("costos-mantenimiento", f"costos-mantenimiento:{year}", ("mantenimientos",), calcular)
+
 @app.get("/mantenimientos-por-prioridad")
 async def get_mantenimientos_por_prioridad():
-    pool = await get_db_pool()
-    
     query = """
         SELECT prioridad, COUNT(*) as cantidad
         FROM mantenimientos
@@ -338,110 +1078,295 @@ async def get_mantenimientos_por_prioridad():
             END
     """
     
-    async with pool.acquire() as conn:
+    async def calcular(conn):
         rows = await conn.fetch(query)
         return [dict(row) for row in rows]
 
+    return await con_cache("mantenimientos-por-prioridad", "mantenimientos-por-prioridad", ("mantenimientos",), calcular)
+
 @app.get("/equipos-garantia")
 async def get_equipos_garantia():
-    pool = await get_db_pool()
-    query = """
-        SELECT 
-            CASE 
-                WHEN fecha_garantia_fin >= CURRENT_DATE THEN 'En garantía'
-                WHEN fecha_garantia_fin < CURRENT_DATE THEN 'Fuera de garantía'
-                ELSE 'Sin información'
-            END as estado_garantia,
-            COUNT(*) as cantidad
-        FROM equipos
-        GROUP BY estado_garantia
+    return await reporte_equipos("equipos-garantia", "mv_equipos_garantia", SnapshotFlota.garantia)
+
+# Consultas y cabeceras del PDF por tipo de reporte
+CONSULTAS_PDF = {
+    "equipos": ("""
+        SELECT e.codigo_inventario, e.nombre, c.nombre as categoria,
+               e.estado_operativo as estado, u.edificio || ' - ' || u.aula_oficina as ubicacion
+        FROM equipos e
+        LEFT JOIN categorias_equipos c ON e.categoria_id = c.id
+        LEFT JOIN ubicaciones u ON e.ubicacion_actual_id = u.id
+        ORDER BY e.codigo_inventario
+    """, ['Código', 'Nombre', 'Categoría', 'Estado', 'Ubicación']),
+    "mantenimientos": ("""
+        SELECT m.id, e.codigo_inventario as codigo, e.nombre as equipo,
+               m.tipo, m.estado, m.costo,
+               COALESCE(m.fecha_realizada, m.fecha_programada, m.fecha_registro) as fecha
+        FROM mantenimientos m
+        JOIN equipos e ON m.equipo_id = e.id
+        ORDER BY fecha DESC
+    """, ['ID', 'Código', 'Equipo', 'Tipo', 'Estado', 'Costo', 'Fecha']),
+    "proveedores": ("""
+        SELECT razon_social, ruc, telefono, email, activo
+        FROM proveedores
+        ORDER BY razon_social
+    """, ['Razón Social', 'RUC', 'Teléfono', 'Email', 'Activo']),
+}
+
+def renderizar_pdf(report_type: str, data: list, generado: str) -> bytes:
+    """
+    Arma el PDF en memoria. Corre en pdf_executor: recibe solo datos
+    planos (cabecera + filas como texto) y devuelve los bytes.
     """
+    output = io.BytesIO()
+    doc = SimpleDocTemplate(output, pagesize=A4)
+    styles = getSampleStyleSheet()
+    elements = [
+        Paragraph(f"<b>Reporte de {report_type.capitalize()}</b>", styles['Title']),
+        Spacer(1, 12),
+        Paragraph(f"Fecha: {generado}", styles['Normal']),
+        Spacer(1, 20),
+    ]
+
+    # LongTable + repeatRows: la tabla se parte en páginas y repite la cabecera
+    table = LongTable(data, repeatRows=1)
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ]))
+    elements.append(table)
+
+    doc.build(elements)
+    return output.getvalue()
+
+async def generar_pdf(report_type: str) -> bytes:
+    query, headers = CONSULTAS_PDF[report_type]
+    pool = await get_db_pool()
     async with pool.acquire() as conn:
         rows = await conn.fetch(query)
-        return [dict(row) for row in rows]
+    data = [headers]
+    data.extend([str(val) if val is not None else '' for val in row] for row in rows)
+    del rows
+
+    # El render corre en otro proceso; el event loop sigue atendiendo requests
+    global pdf_executor
+    executor = get_pdf_executor()
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(
+            executor, renderizar_pdf, report_type, data, datetime.now().strftime('%d/%m/%Y %H:%M')
+        )
+    except BrokenProcessPool:
+        # Murió un proceso (p. ej. por memoria) y el pool no vuelve a aceptar
+        # trabajos: se descarta para que el próximo PDF cree uno nuevo
+        if pdf_executor is executor:
+            pdf_executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+        raise
 
 @app.post("/export/pdf")
 async def export_pdf(report_data: dict):
     report_type = report_data.get("type", "equipos")
-    pool = await get_db_pool()
-    
+    if report_type not in CONSULTAS_PDF:
+        raise HTTPException(status_code=400, detail="Tipo de reporte no válido")
+
     try:
-        filename = f"/app/reportes/{report_type}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-        os.makedirs("/app/reportes", exist_ok=True)
-        
-        doc = SimpleDocTemplate(filename, pagesize=A4)
-        elements = []
-        styles = getSampleStyleSheet()
-        
-        title = Paragraph(f"<b>Reporte de {report_type.capitalize()}</b>", styles['Title'])
-        elements.append(title)
-        elements.append(Spacer(1, 12))
-        date_str = Paragraph(f"Fecha: {datetime.now().strftime('%d/%m/%Y %H:%M')}", styles['Normal'])
-        elements.append(date_str)
-        elements.append(Spacer(1, 20))
-        
-        # Selección de consulta y cabeceras
-        if report_type == "equipos":
-            query = """
-                SELECT e.codigo_inventario, e.nombre, c.nombre as categoria, 
-                       e.estado_operativo as estado, u.edificio || ' - ' || u.aula_oficina as ubicacion
-                FROM equipos e
-                LEFT JOIN categorias_equipos c ON e.categoria_id = c.id
-                LEFT JOIN ubicaciones u ON e.ubicacion_actual_id = u.id
-                ORDER BY e.codigo_inventario
-                LIMIT 100
-            """
-            headers = ['Código', 'Nombre', 'Categoría', 'Estado', 'Ubicación']
-        elif report_type == "mantenimientos":
-            query = """
-                SELECT m.id, e.codigo_inventario as codigo, e.nombre as equipo,
-                       m.tipo, m.estado, m.costo,
-                       COALESCE(m.fecha_realizada, m.fecha_programada, m.fecha_registro) as fecha
-                FROM mantenimientos m
-                JOIN equipos e ON m.equipo_id = e.id
-                ORDER BY fecha DESC
-                LIMIT 200
-            """
-            headers = ['ID', 'Código', 'Equipo', 'Tipo', 'Estado', 'Costo', 'Fecha']
-        elif report_type == "proveedores":
-            query = """
-                SELECT razon_social, ruc, telefono, email, activo
-                FROM proveedores
-                ORDER BY razon_social
-                LIMIT 200
-            """
-            headers = ['Razón Social', 'RUC', 'Teléfono', 'Email', 'Activo']
-        else:
-            raise HTTPException(status_code=400, detail="Tipo de reporte no válido")
+        pdf_bytes = await generar_pdf(report_type)
+        filename = f"{report_type}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+        return Response(
+            content=pdf_bytes,
+            media_type="application/pdf",
+            headers={
+                "Content-Disposition": f'attachment; filename="{filename}"',
+                "Cache-Control": "no-cache"
+            }
+        )
 
-        # Ejecutar consulta y construir tabla
-        async with pool.acquire() as conn:
-            rows = await conn.fetch(query)
-            data = [headers]
-            for row in rows:
-                data.append([str(val) if val is not None else '' for val in row])
-
-        table = Table(data)
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-
-        elements.append(table)
-
-        doc.build(elements)
-        
-        return {"filename": filename, "message": "PDF exportado exitosamente"}
-    
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al exportar: {str(e)}")
 
+# ==================== TRABAJOS DE EXPORTACIÓN ====================
+# Las exportaciones grandes se encolan y las generan EXPORT_WORKERS tareas.
+# El resultado queda en REPORTS_PATH con un nombre derivado de (tipo,
+# formato, versión de los datos): un pedido idéntico se engancha al trabajo
+# en curso o reutiliza el archivo ya generado.
+FORMATOS_EXPORTACION = {**FORMATOS_ARCHIVO, "pdf": ("pdf", "application/pdf")}
+
+# Tablas que lee cada reporte; sus versiones forman la clave del trabajo
+TABLAS_EXPORTACION = {
+    "equipos": ("equipos", "categorias_equipos", "ubicaciones"),
+    "mantenimientos": ("mantenimientos", "equipos"),
+    "proveedores": ("proveedores",),
+}
+
+MAX_TRABAJOS = 1000
+
+class SolicitudExportacion(BaseModel):
+    type: str = "equipos"
+    formato: str = "xlsx"
+    # Genera el archivo de nuevo aunque la versión de los datos no haya cambiado
+    forzar: bool = False
+
+trabajos: "OrderedDict[str, dict]" = OrderedDict()
+trabajos_por_clave: dict[str, str] = {}
+cola_exportacion: asyncio.Queue = asyncio.Queue(maxsize=EXPORT_COLA_MAX)
+
+def trabajo_publico(trabajo: dict) -> dict:
+    datos = {k: v for k, v in trabajo.items() if k not in ("clave", "archivo")}
+    if trabajo["estado"] == "completado":
+        datos["descarga"] = f"/export/jobs/{trabajo['id']}/descarga"
+    return datos
+
+def registrar_trabajo(trabajo: dict):
+    trabajos[trabajo["id"]] = trabajo
+    trabajos_por_clave[trabajo["clave"]] = trabajo["id"]
+    # Se olvidan los trabajos terminados más viejos
+    for job_id in list(trabajos):
+        if len(trabajos) <= MAX_TRABAJOS:
+            break
+        viejo = trabajos[job_id]
+        if viejo["estado"] in ("completado", "error"):
+            del trabajos[job_id]
+            if trabajos_por_clave.get(viejo["clave"]) == job_id:
+                del trabajos_por_clave[viejo["clave"]]
+
+def depurar_reportes():
+    """Borra los archivos usados hace más tiempo hasta respetar los límites del directorio."""
+    archivos = [p for p in REPORTS_PATH.iterdir() if p.is_file() and p.suffix != ".tmp"]
+    archivos.sort(key=lambda p: p.stat().st_mtime)
+    total = sum(p.stat().st_size for p in archivos)
+    while archivos and (total > EXPORT_CACHE_MB * 1024 * 1024 or len(archivos) > EXPORT_CACHE_ARCHIVOS):
+        archivo = archivos.pop(0)
+        total -= archivo.stat().st_size
+        archivo.unlink(missing_ok=True)
+
+async def worker_exportacion():
+    while True:
+        job_id = await cola_exportacion.get()
+        trabajo = trabajos.get(job_id)
+        if trabajo is None:
+            cola_exportacion.task_done()
+            continue
+
+        trabajo["estado"] = "en_proceso"
+        trabajo["iniciado_en"] = datetime.now()
+        destino = REPORTS_PATH / trabajo["archivo"]
+        temporal = destino.with_name(f"{destino.name}.{job_id}.tmp")
+        try:
+            if trabajo["formato"] == "pdf":
+                pdf_bytes = await generar_pdf(trabajo["type"])
+                await asyncio.to_thread(temporal.write_bytes, pdf_bytes)
+            else:
+                pool = await get_db_pool()
+                async with pool.acquire() as conn:
+                    await escribir_archivo(conn, trabajo["type"], trabajo["formato"], str(temporal))
+            # El archivo final aparece completo o no aparece
+            os.replace(temporal, destino)
+            trabajo["estado"] = "completado"
+            trabajo["tamano"] = destino.stat().st_size
+        except Exception as e:
+            temporal.unlink(missing_ok=True)
+            trabajo["estado"] = "error"
+            trabajo["error"] = str(e)
+            print(f"Error en trabajo de exportación {job_id}: {str(e)}")
+        finally:
+            trabajo["terminado_en"] = datetime.now()
+            cola_exportacion.task_done()
+
+        try:
+            await asyncio.to_thread(depurar_reportes)
+        except Exception as e:
+            print(f"Error al depurar {REPORTS_PATH}: {str(e)}")
+
+@app.post("/export/jobs")
+async def crear_trabajo_exportacion(solicitud: SolicitudExportacion):
+    if solicitud.type not in CONSULTAS_EXPORTACION:
+        raise HTTPException(status_code=400, detail="Tipo de reporte no válido")
+    if solicitud.formato not in FORMATOS_EXPORTACION:
+        raise HTTPException(status_code=400, detail=f"formato debe ser uno de: {', '.join(FORMATOS_EXPORTACION)}")
+
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        version = await version_datos(conn, TABLAS_EXPORTACION[solicitud.type])
+    clave = hashlib.sha1(f"{solicitud.type}|{solicitud.formato}|{version}".encode()).hexdigest()[:20]
+    archivo = f"{solicitud.type}_{clave}.{FORMATOS_EXPORTACION[solicitud.formato][0]}"
+
+    # Mismo pedido sobre los mismos datos: se reutiliza el trabajo o el archivo.
+    # La versión puede tardar en reflejar una escritura reciente (ver
+    # version_datos); con forzar solo se reutiliza un trabajo que aún no
+    # empezó a leer.
+    existente = trabajos.get(trabajos_por_clave.get(clave, ""))
+    if existente is not None and (
+        existente["estado"] == "pendiente"
+        or (not solicitud.forzar and existente["estado"] == "en_proceso")
+        or (not solicitud.forzar and existente["estado"] == "completado" and (REPORTS_PATH / archivo).exists())
+    ):
+        return {**trabajo_publico(existente), "reutilizado": True}
+
+    ahora = datetime.now()
+    trabajo = {
+        "id": os.urandom(8).hex(),
+        "type": solicitud.type,
+        "formato": solicitud.formato,
+        "estado": "pendiente",
+        "creado_en": ahora,
+        "iniciado_en": None,
+        "terminado_en": None,
+        "tamano": None,
+        "error": None,
+        "clave": clave,
+        "archivo": archivo,
+    }
+
+    # Archivo generado por una instancia anterior del servicio
+    if not solicitud.forzar and (REPORTS_PATH / archivo).exists():
+        trabajo.update(estado="completado", terminado_en=ahora, tamano=(REPORTS_PATH / archivo).stat().st_size)
+        registrar_trabajo(trabajo)
+        return {**trabajo_publico(trabajo), "reutilizado": True}
+
+    try:
+        cola_exportacion.put_nowait(trabajo["id"])
+    except asyncio.QueueFull:
+        raise HTTPException(status_code=503, detail="La cola de exportación está llena, intente más tarde")
+    registrar_trabajo(trabajo)
+    return {**trabajo_publico(trabajo), "reutilizado": False}
+
+@app.get("/export/jobs/{job_id}")
+async def get_trabajo_exportacion(job_id: str):
+    trabajo = trabajos.get(job_id)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return {**trabajo_publico(trabajo), "en_cola": cola_exportacion.qsize()}
+
+@app.get("/export/jobs/{job_id}/descarga")
+async def descargar_trabajo_exportacion(job_id: str):
+    trabajo = trabajos.get(job_id)
+    if trabajo is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    if trabajo["estado"] != "completado":
+        raise HTTPException(status_code=409, detail=f"El trabajo está {trabajo['estado']}")
+
+    destino = REPORTS_PATH / trabajo["archivo"]
+    try:
+        # Marca el archivo como usado recientemente para la depuración
+        os.utime(destino)
+    except FileNotFoundError:
+        raise HTTPException(status_code=410, detail="El archivo fue depurado, vuelva a solicitar la exportación")
+
+    extension, media_type = FORMATOS_EXPORTACION[trabajo["formato"]]
+    timestamp = trabajo["terminado_en"].strftime('%Y%m%d_%H%M%S')
+    return FileResponse(
+        path=str(destino),
+        media_type=media_type,
+        filename=f"{trabajo['type']}_{timestamp}.{extension}",
+    )
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8004)